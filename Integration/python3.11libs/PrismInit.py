@@ -1,5 +1,10 @@
 import os
 import sys
+import json
+import time
+import socket
+import threading
+import importlib.util
 
 
 def prismInit(prismArgs=[]):
@@ -32,14 +37,131 @@ def prismInit(prismArgs=[]):
     return pcore
 
 
+class LazyPrismCore:
+    """
+    Stands in for PrismCore until something uses it, then creates it
+    launches that never touch prism, eg. hython on the render nodes, never pay for it
+
+    warm_up imports prism on a background thread, PrismCore itself makes Qt
+    objects so it is only created on the main thread, when houdini is idle
+    """
+    def __init__(self, factory=prismInit):
+        self._factory = factory
+        self._core = None
+        self._attempted = False # a failed start, eg. no PRISM_ROOT, is not tried again
+        self._lock = threading.RLock()
+        self.timings = {} # step: seconds
+
+    @property
+    def loaded(self) -> bool:
+        return self._core is not None
+
+    def get(self):
+        """The real PrismCore, created on the first call, None when that failed"""
+        if not self._attempted:
+            with self._lock:
+                if not self._attempted:
+                    start = time.perf_counter()
+                    try:
+                        self._core = self._factory()
+                    finally:
+                        self._attempted = True
+                    self.timings["create"] = time.perf_counter() - start
+                    _report("create", self.timings["create"])
+        return self._core
+
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        core = self.get()
+        if core is None:
+            raise AttributeError(f"PrismCore is not available, no {name}")
+        return getattr(core, name)
+
+    def warm_up(self):
+        """Imports prism in the background and creates the core when houdini is idle"""
+        def run():
+            start = time.perf_counter()
+            try:
+                root = os.getenv("PRISM_ROOT", "")
+                if root and os.path.join(root, "Scripts") not in sys.path:
+                    sys.path.append(os.path.join(root, "Scripts"))
+                import PrismCore # noqa: F401, the slow part that is safe off the main thread
+            except Exception as e:
+                print(f"Prism warm up failed: {e}")
+                return
+            self.timings["import"] = time.perf_counter() - start
+            _report("import", self.timings["import"])
+            try:
+                import hdefereval
+            except ImportError:
+                return # no event loop, created on first use
+            hdefereval.executeDeferredAfterWaiting(self.get, 1)
+
+        threading.Thread(target=run, name="PrismWarmUp", daemon=True).start()
+
+
+def _report(step, seconds):
+    """
+    Logs how long a startup step took, PRISM_STARTUP_LOG names a file to
+    append them to as json lines, eg. to compare the render nodes
+    """
+    print(f"Prism {step}: {seconds:.3f}s")
+    path = os.getenv("PRISM_STARTUP_LOG")
+    if not path:
+        return
+    record = {
+        "time": time.time(), "host": socket.gethostname(), "pid": os.getpid(),
+        "executable": os.path.basename(sys.executable), "step": step, "seconds": round(seconds, 4),
+        "mode": os.getenv("PRISM_LAZY_CORE", "auto"),
+    }
+    try:
+        with open(path, "a") as f:
+            f.write(json.dumps(record) + "\n")
+    except OSError as e:
+        print(f"Could not write the prism startup log {path}: {e}")
+
+
+def get_core():
+    """The PrismCore of this session, created now if it is not yet, None when prism is not available"""
+    global pcore
+    if "pcore" not in globals():
+        pcore = LazyPrismCore(prismInit) # so a failed start is remembered too
+    if isinstance(pcore, LazyPrismCore):
+        return pcore.get()
+    return pcore
+
+
 def createPrismCore():
+    """
+    PRISM_LAZY_CORE picks how prism starts:
+        0     create PrismCore now, like before
+        1     create it on first use
+        warm  on first use, importing it in the background meanwhile
+    by default sessions with a ui warm up and the others, eg. hython, are lazy
+    """
+    start = time.perf_counter()
     if os.getenv("PRISM_ENABLED") == "0":
         return
     
-    try:
-        import PySide2
-    except:
+    # find_spec does not import it, that is left to whoever needs Qt
+    if importlib.util.find_spec("PySide2") is None:
         return
 
     global pcore
-    pcore = prismInit()
+    mode = os.getenv("PRISM_LAZY_CORE", "")
+    if mode == "0":
+        pcore = prismInit()
+    else:
+        pcore = LazyPrismCore(prismInit)
+        if mode == "warm" or (mode == "" and _has_ui()):
+            pcore.warm_up()
+    _report("startup", time.perf_counter() - start)
+
+
+def _has_ui() -> bool:
+    try:
+        import hou
+        return hou.isUIAvailable()
+    except (ImportError, AttributeError):
+        return False
@@ -0,0 +1,240 @@
+'''
+Exports many sequences in one run from a manifest, eg. a supervisor
+regenerating the dailies of a whole sequence
+
+the manifest is json, defaults apply to every item:
+{
+    "defaults": {"codec": "h264", "tier": "review", "framerate": 24},
+    "items": [
+        {"source": "/renders/sh010/comp.$F4.exr", "hip": "/shots/sh010/Scenefiles/comp/sh010_v0003.hip",
+         "identifier": "comp"},
+        {"source": "/renders/sh020/comp.$F4.exr", "context": {"type": "shot", "sequence": "SQ010", "shot": "sh020",
+         "project_path": "/projects/demo"}, "identifier": "comp", "frames": [1001, 1050], "keep_images": false}
+    ]
+}
+
+source is a sequence on disk with $F4 for the frame number, hip or context
+says which entity it belongs to, items may be in different projects. Every item becomes the next playblast
+version of its entity and identifier, its frames are copied into the version
+and encoded. All items expand into one job graph so they run in parallel
+
+item keys, all optional but source, identifier and hip or context:
+    frames [first, last]     defaults to the frames of source on disk
+    version                  instead of the next free one
+    video                    encode a video, default true
+    keep_images              copy the frames into the version, default true
+    codec, tier, framerate, chunks
+
+usage:
+    python batch.py dailies.json --dryrun
+    python batch.py dailies.json --worker
+'''
+
+import os
+import sys
+import json
+import argparse
+import logging
+
+import logic
+import encode
+import prism_resolver
+
+LOG = logging.getLogger(__name__)
+
+DEFAULTS = {
+    "video": True,
+    "keep_images": True,
+    "framerate": 24,
+    "codec": encode.DEFAULT_PROFILE,
+    "tier": encode.DEFAULT_TIER,
+    "chunks": None,
+}
+
+
+class Batch:
+    '''
+    Expands manifest items into the jobs of one Exporter
+
+    scene file contexts come from the cache of Logic.contexts_from_paths, versions are
+    looked up once per entity and identifier, items sharing both get consecutive versions
+
+    pcore answers for the items of its project, connect(project_path) gives the
+    pcore of any other project. Without connect, items of other projects are refused
+    '''
+    def __init__(self, pcore, exporter: logic.Exporter, logic_class=logic.Logic, connect=None):
+        self.pcore = pcore
+        self.exporter = exporter
+        self.logic = logic_class
+        self.connect = connect
+        self._cores = {} # normalized project path: pcore of the other projects
+        self._versions = {} # (project, entity, identifier): last version handed out
+
+    def core(self, item):
+        '''The pcore of the project of an item'''
+        if "context" in item:
+            path = project_path = item["context"].get("project_path")
+        else:
+            path = item.get("hip") or item.get("source")
+            project_path = prism_resolver.find_project(path) if path else None
+        own_path = getattr(self.pcore, "projectPath", None)
+        if project_path is None or (own_path and _normpath(project_path) == _normpath(own_path)):
+            return self.pcore
+        key = _normpath(project_path)
+        if key not in self._cores:
+            if self.connect is None:
+                raise ValueError(f"{path} is not in the project {own_path}, batches without connect take one project")
+            self._cores[key] = self.connect(project_path)
+        return self._cores[key]
+
+    def context(self, item, pcore=None) -> dict:
+        '''The playblast context of an item, a copy the caller may change'''
+        pcore = pcore or self.core(item)
+        if "context" in item:
+            context = dict(item["context"])
+        elif "hip" in item:
+            context = self.logic.context_from_path(pcore, item["hip"])
+        else:
+            raise ValueError(f"Item of {item.get('source')} has neither hip nor context")
+        if not context:
+            raise ValueError(f"{item['hip']} is no scene file of a prism project")
+        context.setdefault("project_path", getattr(pcore, "projectPath", None))
+        self.logic.fix_pcore_project(pcore, context)
+        return context
+
+    def allocate_version(self, context, identifier, version=None, pcore=None) -> int:
+        '''
+        The version for the next item of this entity and identifier
+        the first item asks for the latest version, later items count on from it
+        '''
+        key = (_normpath(context.get("project_path")), _entity_key(context), identifier)
+        if version is None:
+            if key not in self._versions:
+                self._versions[key] = self.logic.get_latest_playblast_version(pcore or self.pcore, context, identifier)
+            version = self._versions[key] + 1
+        self._versions[key] = max(self._versions.get(key, 0), int(version))
+        return int(version)
+
+    def add(self, item) -> list:
+        '''Queues the jobs of one item, returns them'''
+        item = {**DEFAULTS, **item}
+        source = item["source"]
+        identifier = item["identifier"].replace(" ", "_")
+        frames = item.get("frames") or _source_range(source)
+        if not frames:
+            raise ValueError(f"No frames of {source} on disk and no frame range given")
+
+        pcore = self.core(item)
+        context = self.context(item, pcore)
+        version = self.allocate_version(context, identifier, item.get("version"), pcore)
+        image_format = os.path.splitext(source)[1]
+        sequence = self.logic.construct_outputpath(pcore, identifier, version, image_format, context)
+        profile = encode.get_profile(item["codec"])
+        video = self.logic.construct_outputpath(pcore, identifier, version, profile.extension, context, frame=None)
+
+        queued = []
+        encode_input, before_encode = source, []
+        if item["keep_images"]:
+            copy = self.exporter.add(logic.Job(inputpath=source, outputpath=sequence, frames=list(frames), type="copy"))
+            queued.append(copy)
+            if self.exporter.dedupe:
+                # encodes from the version so the video can be linked with the frames
+                dedupe = self.exporter.add(
+                    logic.Job(inputpath=sequence, outputpath=video if item["video"] else "", type="dedupe"), depends_on=[copy]
+                )
+                queued.append(dedupe)
+                encode_input, before_encode = sequence, [dedupe]
+        if item["video"]:
+            job = logic.Job(
+                inputpath=encode_input, outputpath=video, frames=list(frames), framerate=item["framerate"],
+                type="ffmpeg", codec=profile.name, tier=item["tier"],
+            )
+            before = len(self.exporter.queue)
+            self.exporter.add_encode(job, depends_on=before_encode, chunks=item["chunks"])
+            queued.extend(self.exporter.queue[before:])
+        LOG.info(f"{identifier} v{version} of {'/'.join(_entity_key(context)[1:])}: {len(queued)} jobs")
+        return queued
+
+    def add_manifest(self, manifest: dict) -> list:
+        defaults = manifest.get("defaults", {})
+        # finds the project of every item before queueing any, and resolves the
+        # scene files of each project in one go, the items then find them cached
+        hips = {} # id(pcore): (pcore, scene files)
+        for item in manifest["items"]:
+            pcore = self.core(item)
+            if "hip" in item:
+                hips.setdefault(id(pcore), (pcore, set()))[1].add(item["hip"])
+        for pcore, paths in hips.values():
+            self.logic.contexts_from_paths(pcore, paths)
+        queued = []
+        for item in manifest["items"]:
+            queued.extend(self.add({**defaults, **item}))
+        return queued
+
+
+def load_manifest(path) -> dict:
+    with open(path) as f:
+        manifest = json.load(f)
+    if not isinstance(manifest.get("items"), list):
+        raise ValueError(f"{path} has no list of items")
+    return manifest
+
+
+def build(pcore, manifest: dict, connect=None, **exporter_kwargs) -> logic.Exporter:
+    '''One Exporter with the jobs of every item of the manifest, see Batch for connect'''
+    exporter = logic.Exporter({"manifest": manifest}, logic.Logic, **exporter_kwargs)
+    Batch(pcore, exporter, connect=connect).add_manifest(manifest)
+    return exporter
+
+
+def _source_range(source) -> list:
+    frames = encode.sequence_frames(source)
+    return [min(frames), max(frames)] if frames else []
+
+
+def _normpath(path) -> str:
+    return os.path.normcase(os.path.normpath(str(path)))
+
+
+def _entity_key(context) -> tuple:
+    if context.get("type") == "asset":
+        return ("asset", context["asset_path"].replace("\\", "/"))
+    if context.get("type") == "shot":
+        return ("shot", context["sequence"], context["shot"])
+    raise ValueError(f"Context is neither an asset nor a shot: {context}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("manifest", help="json manifest of the sequences to export")
+    parser.add_argument("--dryrun", action="store_true", help="print the commands instead of running them")
+    parser.add_argument("--workers", type=int, help="jobs run at once")
+    parser.add_argument("--dedupe", action="store_true", help="link versions identical to the previous one")
+    parser.add_argument("--worker", action="store_true", help="hand the jobs to the export worker and return")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+
+    manifest = load_manifest(args.manifest)
+    # the project of the first item, the others connect as they come, prism itself only starts if it has to
+    first = manifest["items"][0] if manifest["items"] else {}
+    pcore = prism_resolver.connect(
+        first.get("hip") or first.get("context", {}).get("project_path") or first.get("source")
+    )
+
+    exporter = build(
+        pcore, manifest, connect=prism_resolver.connect, dryrun=args.dryrun, workers=args.workers, dedupe=args.dedupe,
+    )
+    if args.worker and not args.dryrun:
+        export_id = exporter.execute_detached()
+        print(f"export {export_id}")
+        return 0
+    success = exporter.execute(on_job=lambda job: LOG.info(f"{job.status} {job}"))
+    return 0 if success else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,335 @@
+'''
+Benchmarks for elPapi against a synthetic prism project
+
+usage:
+    python bench_elPapi.py [project_path]
+    python bench_elPapi.py --suite [--assets 200 --shots 50 ...] [--save results.json] [--compare results.json]
+
+when no path is given a synthetic project is created in a temp folder and
+the polling watcher is checked against it
+--suite times the project loading steps and records wall time, filesystem
+calls and peak memory of each, --compare fails when one got slower than the
+saved results by more than --tolerance
+'''
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import itertools
+import tempfile
+import tracemalloc
+from pathlib import Path
+
+import elPapi
+import watcher
+
+
+def make_synthetic_project(root, assets=20, sequences=5, shots=20,
+                           identifiers=2, versions=3, frames=100) -> Path:
+    '''
+    Creates an empty prism style project on disk
+    every playblast version holds a frame sequence of empty jpgs
+    '''
+    root = Path(root)
+    root.joinpath("00_Pipeline").mkdir(parents=True, exist_ok=True)
+    production = root.joinpath("03_Production")
+
+    entities = [production / "Assets" / f"asset_{a:03d}" for a in range(assets)]
+    for s in range(sequences):
+        for sh in range(shots):
+            entities.append(production / "Shots" / f"sq_{s:03d}" / f"sh_{sh:03d}")
+
+    for entity in entities:
+        for folder in ["Export", "Renders", "Scenefiles"]:
+            entity.joinpath(folder).mkdir(parents=True, exist_ok=True)
+        for i in range(identifiers):
+            identifier = f"identifier_{i:02d}"
+            for v in range(1, versions + 1):
+                version_dir = entity / "Playblasts" / identifier / f"v{v:04d}"
+                version_dir.mkdir(parents=True, exist_ok=True)
+                for f in range(1, frames + 1):
+                    version_dir.joinpath(f"{identifier}_v{v:04d}.{f:04d}.jpg").touch()
+    return root
+
+
+def timeit(func, *args, repeat=3, **kwargs):
+    '''Returns the best wall time of repeat runs and the last result'''
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        duration = time.perf_counter() - start
+        best = duration if best is None else min(best, duration)
+    return best, result
+
+
+def sorted_files(file_tree) -> dict:
+    '''Sorts every _files list, sequences change the order files are listed in'''
+    return {
+        name: sorted(value) if name == "_files" else sorted_files(value)
+        for name, value in file_tree.items()
+    }
+
+
+def bench_walk(project_path):
+    '''Compare read_file_structure with the parallel scandir walker'''
+    base_time, base_tree = timeit(elPapi.read_file_structure, project_path)
+    print(f"read_file_structure: {base_time:.3f}s")
+
+    for workers in [1, 4, 16, 32]:
+        scan_time, scan_tree = timeit(elPapi.scan_file_structure, project_path, workers=workers)
+        assert scan_tree == base_tree, "scan_file_structure returned a different tree"
+        print(f"scan_file_structure workers={workers}: {scan_time:.3f}s ({base_time / scan_time:.2f}x)")
+
+    scan_time, root = timeit(elPapi.scan_tree, project_path)
+    assert sorted_files(root.to_dict()) == sorted_files(base_tree), "scan_tree returned a different tree"
+    sequences = sum(len(node.files.sequences) for node in root.walk())
+    print(f"scan_tree: {scan_time:.3f}s ({base_time / scan_time:.2f}x), {sequences} frame sequences")
+
+    prune = elPapi.prune_rules("media")
+    scan_time, _ = timeit(elPapi.scan_file_structure, project_path, prune=prune)
+    print(f"scan_file_structure prune={sorted(prune)}: {scan_time:.3f}s ({base_time / scan_time:.2f}x)")
+
+
+def check_watcher(project_path):
+    '''
+    Polls a tree built by load_structure after folders were added to it,
+    its nodes are plain Nodes until the indexes classify them
+    adds folders to the project, run it on a synthetic one
+    '''
+    project = elPapi.Project(project_path)
+    project.load_structure(use_snapshot=False)
+    poller = watcher.PollingWatcher(project)
+    poller.poll() # takes the mtimes, the tree was built without them
+
+    identifier = Path(project_path, "03_Production", "Assets", "asset_000", "Playblasts", "identifier_00")
+    version = max(int(name[1:]) for name in os.listdir(identifier)) + 1
+    identifier.joinpath(f"v{version:04d}").mkdir()
+    assert poller.poll(), "the new version folder was not noticed"
+    asset = project.get_asset("asset_000")
+    assert project.latest_version(asset, "playblasts", "identifier_00") == version, "latest_version missed the new version"
+
+    # the sequence of a shot found with get_shot stays a plain Node
+    project.get_shot("sq_000/sh_000")
+    Path(project_path, "03_Production", "Shots", "sq_000", "sh_new", "Playblasts").mkdir(parents=True)
+    assert poller.poll(), "the new shot folder was not noticed"
+    assert "sq_000/sh_new" in project._shots, "the new shot is not in the index"
+    print("PollingWatcher on load_structure: ok")
+
+
+def synthetic_file_tree(files=1_000_000, frames=1000) -> dict:
+    '''
+    Builds a read_file_structure style dict in memory without touching the disk
+    playblast versions of frames files each, spread over 100 shots
+    every 100th frame is missing so sequences carry holes
+    '''
+    file_tree = {"_files": []}
+    versions = max(files // frames, 1)
+    for v in range(versions):
+        shot = f"sh_{v % 100:03d}"
+        version = f"v{v // 100 + 1:04d}"
+        node = file_tree
+        for part in ["03_Production", "Shots", "sq_010", shot, "Playblasts", "Effects", version]:
+            node = node.setdefault(part, {"_files": []})
+        node["_files"].extend(
+            f"sq_010-{shot}_Effects_{version}.{f:04d}.jpg" for f in range(1, frames + 1) if f % 100
+        )
+    return file_tree
+
+
+def traced(func, *args):
+    '''Returns the bytes still allocated by func and its result'''
+    tracemalloc.start()
+    try:
+        result = func(*args)
+        allocated, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return allocated, result
+
+
+def bench_memory(files=1_000_000):
+    '''Memory of the nested dict against the compact Node tree, per 1M files'''
+    dict_bytes, file_tree = traced(synthetic_file_tree, files)
+    node_bytes, _ = traced(elPapi.Node.from_dict, file_tree, "S:/job")
+    scale = 1_000_000 / files
+    print(f"nested dict: {dict_bytes * scale / 2**20:.1f} MB per 1M files")
+    print(f"Node tree:   {node_bytes * scale / 2**20:.1f} MB per 1M files ({dict_bytes / node_bytes:.1f}x smaller)")
+
+
+# os functions that reach the filesystem, os.walk and pathlib go through these too
+COUNTED_CALLS = ["scandir", "listdir", "stat", "lstat"]
+
+
+class FsCalls:
+    '''
+    Counts calls to the os filesystem functions while in the with block
+    python level calls, a portable stand in for counting syscalls
+    '''
+    def __init__(self):
+        self.counts = {}
+        self._originals = {}
+
+    def __enter__(self):
+        for name in COUNTED_CALLS:
+            original = getattr(os, name)
+            counter = itertools.count() # next() is atomic, walkers call from threads
+            self._originals[name] = original
+            self.counts[name] = counter
+            setattr(os, name, _counted(original, counter))
+        return self
+
+    def __exit__(self, *exc):
+        for name, original in self._originals.items():
+            setattr(os, name, original)
+        self.counts = {name: next(counter) for name, counter in self.counts.items()}
+        self._originals.clear()
+
+    @property
+    def total(self) -> int:
+        return sum(self.counts.values())
+
+
+def _counted(func, counter):
+    def wrapper(*args, **kwargs):
+        next(counter)
+        return func(*args, **kwargs)
+    return wrapper
+
+
+def measure(func, *args, repeat=3, **kwargs) -> dict:
+    '''
+    Best wall time of repeat runs, then one more run for the filesystem calls
+    and peak memory, tracing slows the run down so it is not timed
+    '''
+    wall, result = timeit(func, *args, repeat=repeat, **kwargs)
+    with FsCalls() as calls:
+        tracemalloc.start()
+        try:
+            func(*args, **kwargs)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+    return {"wall": wall, "fs_calls": calls.total, "peak_mb": peak / 2**20, "result": result}
+
+
+def _load_assets(project_path):
+    project = elPapi.Project(project_path)
+    project._load_assets()
+    return project
+
+def _build_version_index(project_path):
+    project = elPapi.Project(project_path)
+    project.build_version_index()
+    return project
+
+def _latest_versions(project):
+    '''Latest version of every (entity, mediaType, identifier) in the project'''
+    keys = list(project._versions.keys())
+    for entity, media_type, identifier in keys:
+        project.latest_version(entity, media_type, identifier)
+    return len(keys)
+
+
+def run_suite(project_path, repeat=3) -> dict:
+    '''Times the project loading steps, returns {name: measurements}'''
+    results = {}
+    results["read_file_structure"] = measure(elPapi.read_file_structure, project_path, repeat=repeat)
+    results["scan_tree"] = measure(elPapi.scan_tree, project_path, repeat=repeat)
+    results["Project._load_assets"] = measure(_load_assets, project_path, repeat=repeat)
+    results["Project.build_version_index"] = measure(_build_version_index, project_path, repeat=repeat)
+
+    project = _build_version_index(project_path)
+    lookups = measure(_latest_versions, project, repeat=repeat)
+    count = max(lookups["result"], 1)
+    for key in ["wall", "fs_calls"]:
+        lookups[key] /= count # per lookup
+    results["Project.latest_version"] = lookups
+
+    for stats in results.values():
+        del stats["result"]
+    return results
+
+
+def print_results(results, baseline=None):
+    print(f"{'':30} {'wall':>10} {'fs calls':>10} {'peak MB':>9}")
+    for name, stats in results.items():
+        line = f"{name:30} {stats['wall'] * 1000:8.2f}ms {stats['fs_calls']:10.0f} {stats['peak_mb']:9.2f}"
+        if baseline and name in baseline:
+            line += f"   {stats['wall'] / baseline[name]['wall']:.2f}x of baseline"
+        print(line)
+
+
+def regressions(results, baseline, tolerance=0.25) -> list:
+    '''Names of the steps whose wall time grew by more than tolerance, or that list more folders'''
+    slower = []
+    for name, stats in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        if stats["wall"] > base["wall"] * (1 + tolerance) or stats["fs_calls"] > base["fs_calls"]:
+            slower.append(name)
+    return slower
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("project_path", nargs="?", help="existing project, a synthetic one is made otherwise")
+    parser.add_argument("--suite", action="store_true", help="run the benchmark suite instead of the walker comparison")
+    parser.add_argument("--assets", type=int, default=20)
+    parser.add_argument("--sequences", type=int, default=5)
+    parser.add_argument("--shots", type=int, default=20, help="shots per sequence")
+    parser.add_argument("--identifiers", type=int, default=2, help="playblast identifiers per entity")
+    parser.add_argument("--versions", type=int, default=3, help="versions per identifier")
+    parser.add_argument("--frames", type=int, default=100, help="frames per version")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--save", help="write the suite results to this json file")
+    parser.add_argument("--compare", help="json file of earlier results, exits 1 on a regression")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed wall time growth for --compare")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    tmp_dir = None
+    project_path = args.project_path
+    if project_path is None:
+        tmp_dir = tempfile.mkdtemp(prefix="elPapi_bench_")
+        project_path = make_synthetic_project(
+            os.path.join(tmp_dir, "Demo"), assets=args.assets, sequences=args.sequences,
+            shots=args.shots, identifiers=args.identifiers, versions=args.versions, frames=args.frames,
+        )
+    try:
+        if not args.suite:
+            bench_memory()
+            bench_walk(project_path)
+            if tmp_dir is not None:
+                check_watcher(project_path)
+            return 0
+
+        results = run_suite(project_path, repeat=args.repeat)
+        baseline = None
+        if args.compare:
+            with open(args.compare) as f:
+                baseline = json.load(f)
+        print_results(results, baseline)
+        if args.save:
+            with open(args.save, "w") as f:
+                json.dump(results, f, indent=4)
+        if baseline:
+            slower = regressions(results, baseline, args.tolerance)
+            if slower:
+                print(f"Regressions: {', '.join(slower)}")
+                return 1
+        return 0
+    finally:
+        if tmp_dir is not None:
+            shutil.rmtree(tmp_dir)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,185 @@
+'''
+Links unchanged playblast versions to the previous version instead of encoding again
+
+every version folder gets a small cache of the content hash of each frame,
+keyed by frame number with the size and mtime the hash was made from, so a
+frame is only read again when it changed. When every frame of a new version
+matches the previous version, the new frames and the video become hardlinks
+to the previous ones
+
+versions are found by the prism layout, the version folder and the file name
+both carry the version, eg. Playblasts/apex/v0005/apex_v0005.$F4.jpg
+'''
+
+import os
+import re
+import json
+import time
+import hashlib
+import logging
+
+import encode
+
+LOG = logging.getLogger(__name__)
+
+CACHE_NAME = ".mplay_hashes" # json, next to the frames of each version
+_version_dir = re.compile(r"^v(\d+)$")
+
+
+class Savings:
+    '''What linking instead of writing and encoding saved'''
+    def __init__(self, bytes=0, seconds=0.0, versions=0):
+        self.bytes = bytes
+        self.seconds = seconds
+        self.versions = versions
+
+    def add(self, other):
+        self.bytes += other.bytes
+        self.seconds += other.seconds
+        self.versions += other.versions
+
+    def __bool__(self):
+        return self.versions > 0
+
+    def __str__(self):
+        return f"{self.versions} versions linked, {self.bytes / 2**20:.1f} MB and {self.seconds:.1f}s saved"
+
+
+def hash_file(path, chunk_size=1 << 20) -> str:
+    digest = hashlib.blake2b(digest_size=20)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def load_cache(folder) -> dict:
+    try:
+        with open(os.path.join(folder, CACHE_NAME)) as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return {"frames": {}}
+    cache.setdefault("frames", {})
+    return cache
+
+
+def save_cache(folder, cache):
+    path = os.path.join(folder, CACHE_NAME)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "w") as f:
+            json.dump(cache, f)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        LOG.warning(f"Could not write the hash cache {path}: {e}")
+
+
+def hash_sequence(sequence) -> dict:
+    '''
+    {frame: hash} of a $F4 style sequence, hashes of unchanged frames come
+    from the cache of the folder, which is updated
+    '''
+    folder = os.path.dirname(str(sequence))
+    cache = load_cache(folder)
+    cached = cache["frames"]
+    hashes = {}
+    entries = {}
+    for frame, stat in encode.sequence_frames(sequence).items():
+        key = str(frame) # json keys are strings
+        entry = cached.get(key)
+        if entry is None or entry[0] != stat.st_size or entry[1] != stat.st_mtime_ns:
+            path = encode.frame_path(sequence, frame)
+            entry = [stat.st_size, stat.st_mtime_ns, hash_file(path)]
+        entries[key] = entry
+        hashes[frame] = entry[2]
+    if entries != cached:
+        cache["frames"] = entries
+        save_cache(folder, cache)
+    return hashes
+
+
+def previous_version(path):
+    '''
+    path with its version replaced by the highest lower version on disk, None when there is none
+    path is a sequence or video inside a version folder
+    '''
+    folder, name = os.path.split(str(path))
+    identifier_dir, version_name = os.path.split(folder)
+    match = _version_dir.match(version_name)
+    if match is None:
+        return None
+    number = int(match.group(1))
+    versions = []
+    try:
+        with os.scandir(identifier_dir) as entries:
+            for entry in entries:
+                found = _version_dir.match(entry.name)
+                if found and int(found.group(1)) < number and entry.is_dir():
+                    versions.append((int(found.group(1)), entry.name))
+    except OSError:
+        return None
+    if not versions:
+        return None
+    _, previous = max(versions)
+    return os.path.join(identifier_dir, previous, name.replace(version_name, previous))
+
+
+def link_previous_version(sequence, video=None) -> Savings:
+    '''
+    Replaces the frames of sequence and creates video as hardlinks to the
+    previous version when every frame is identical to it
+    '''
+    previous_sequence = previous_version(sequence)
+    hashes = hash_sequence(sequence)
+    if previous_sequence is None or not hashes:
+        return Savings()
+    previous_hashes = hash_sequence(previous_sequence)
+    if hashes != previous_hashes:
+        return Savings()
+
+    savings = Savings(versions=1)
+    for frame in hashes:
+        new = encode.frame_path(sequence, frame)
+        old = encode.frame_path(previous_sequence, frame)
+        if os.path.samefile(new, old):
+            continue
+        size = os.path.getsize(new)
+        if not _replace_with_link(old, new):
+            return Savings() # no hardlinks on this filesystem
+        savings.bytes += size
+
+    if video:
+        previous_video = previous_version(video)
+        if previous_video and os.path.exists(previous_video) and not os.path.exists(video):
+            if _replace_with_link(previous_video, video):
+                seconds = load_cache(os.path.dirname(previous_video)).get("encode_seconds", 0.0)
+                savings.bytes += os.path.getsize(video)
+                savings.seconds += seconds
+                record_encode(video, seconds) # still what it saves when linked again
+
+    # the frames now carry the mtimes of the previous version
+    hash_sequence(sequence)
+    LOG.info(f"{sequence} is identical to {previous_sequence}, linked")
+    return savings
+
+
+def record_encode(video, seconds):
+    '''Keeps how long the video took to encode, it is what linking it saves next time'''
+    folder = os.path.dirname(str(video))
+    cache = load_cache(folder)
+    cache["encode_seconds"] = seconds
+    save_cache(folder, cache)
+
+
+def _replace_with_link(source, target) -> bool:
+    '''Makes target a hardlink to source, atomically when target exists'''
+    tmp_path = f"{target}.{os.getpid()}.{time.monotonic_ns()}.lnk"
+    try:
+        os.link(source, tmp_path)
+        os.replace(tmp_path, target)
+    except OSError as e:
+        LOG.warning(f"Could not link {target} to {source}: {e}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return False
+    return True
@@ -47,8 +47,22 @@ for example 1 to many relationships, 1 to 1 relationships, etc
 """
 
 import os
+import re
+import sys
+import queue
+import threading
+import pickle
+import hashlib
+import logging
+from array import array
+from bisect import bisect_left, insort
+from itertools import accumulate
+from operator import attrgetter
 from pathlib import Path
 from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+
+LOG = logging.getLogger(__name__)
 
 # vocabulary:
 '''
@@ -68,6 +82,26 @@ relationships = {
     "departments": ["tasks"],
 }
 
+# folder names on disk for each child of an entity
+# any folder containing one of these is a shot or asset
+folders = {
+    "scenefiles": ["Scenefiles"],
+    "products": ["Export"],
+    "media": ["Playblasts", "Renders"],
+}
+
+def prune_rules(*keep):
+    '''
+    Returns the entity folder names to skip when walking the project
+    keep is a list of relationships to keep, eg. prune_rules("media")
+    will skip Scenefiles and Export folders
+    '''
+    skip = set()
+    for relationship in relationships["entity"]:
+        if relationship not in keep:
+            skip.update(folders.get(relationship, []))
+    return frozenset(skip)
+
 def read_file_structure(root_path):
     """
     Reads the entire file structure into a nested dictionary.
@@ -90,22 +124,550 @@ def read_file_structure(root_path):
 
     return file_tree
 
+def _list_dir(path):
+    '''
+    Lists a single directory, returns (files, dirs, mtime_ns)
+    like os.walk, symlinked folders are not followed and unreadable folders are empty
+    the mtime is read before listing so a change during the listing is caught next refresh
+    '''
+    files = []
+    dirs = []
+    mtime = None
+    try:
+        mtime = os.stat(path).st_mtime_ns
+        with os.scandir(path) as entries:
+            for entry in entries:
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    is_dir = False
+                if not is_dir:
+                    files.append(entry.name)
+                elif not entry.is_symlink():
+                    dirs.append(entry.name)
+    except OSError:
+        pass
+    return files, dirs, mtime
+
+def _list_dir_table(path):
+    '''Same as _list_dir but the files are already a FileTable with their sequences collapsed'''
+    files, dirs, mtime = _list_dir(path)
+    return FileTable(files), dirs, mtime
+
+def _dir_mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+def _skip_rule(prune):
+    if prune is None:
+        return lambda name: False
+    if callable(prune):
+        return prune
+    return frozenset(prune).__contains__
+
+def _apply_listing(node, files, dirs, mtime=None):
+    '''
+    Sets the files and child folders of a dict or Node from a listing
+    children still on disk are kept, returns (removed names, added [(name, child)])
+    '''
+    if isinstance(node, Node):
+        return node.set_listing(files, dirs, mtime)
+
+    node["_files"] = files
+    keep = set(dirs)
+    removed = [name for name in node if name != "_files" and name not in keep]
+    for name in removed:
+        del node[name]
+    added = []
+    for name in dirs:
+        if name not in node:
+            node[name] = {"_files": []}
+            added.append((name, node[name]))
+    return removed, added
+
+def _walk(pool, root_path, start, max_depth, skip, mtimes, lister=_list_dir):
+    '''
+    Lists every directory in start and everything below it
+    start is a list of (parts, node) where parts is the path relative to root_path
+    the tree is only modified on this thread, workers just run the lister
+    '''
+    results = queue.SimpleQueue()
+
+    def submit(parts, node):
+        future = pool.submit(lister, os.path.join(root_path, *parts))
+        future.add_done_callback(lambda f: results.put((parts, node, f)))
+
+    for parts, node in start:
+        submit(parts, node)
+    pending = len(start)
+
+    while pending:
+        parts, current_node, future = results.get()
+        pending -= 1
+        files, dirs, mtime = future.result()
+        if mtimes is not None:
+            mtimes[parts] = mtime
+
+        at_limit = max_depth is not None and len(parts) >= max_depth
+        if at_limit and not isinstance(current_node, Node):
+            dirs = []
+        dirs = [dirname for dirname in dirs if not skip(dirname)]
+        _, added = _apply_listing(current_node, files, dirs, mtime)
+        if at_limit:
+            continue # Node children below the limit are listed on first access
+        for dirname, child in added:
+            submit(parts + (dirname,), child)
+            pending += 1
+
+def scan_file_structure(root_path, max_depth=None, prune=None, workers=None, mtimes=None):
+    '''
+    Reads the file structure into the same nested dictionary as read_file_structure
+    Every directory is listed with os.scandir on a thread pool, so listings
+    on a network share happen in parallel instead of one after the other
+
+    max_depth is the number of folder levels below root_path to read, None for all
+    prune is a set of folder names to skip (see prune_rules) or a callable(name)
+    mtimes is an optional dict filled with {path parts: mtime_ns} for every folder read
+    '''
+    root_path = os.fspath(root_path)
+    if not os.path.isdir(root_path):
+        return {}
+
+    file_tree = {"_files": []}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        _walk(pool, root_path, [((), file_tree)], max_depth, _skip_rule(prune), mtimes)
+    return file_tree
+
+def scan_tree(root_path, max_depth=None, prune=None, workers=None, mtimes=None):
+    '''
+    Same as scan_file_structure but builds a compact Node tree
+    frame sequences are collapsed by the workers while the folders are listed
+    Returns None if root_path is not a folder
+    '''
+    root_path = os.fspath(root_path)
+    if not os.path.isdir(root_path):
+        return None
+
+    root = Node(root_path)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        _walk(pool, root_path, [((), root)], max_depth, _skip_rule(prune), mtimes, _list_dir_table)
+    return root
+
+def refresh_file_structure(root_path, file_tree, mtimes, max_depth=None, prune=None, workers=None) -> int:
+    '''
+    Updates a tree from scan_file_structure or scan_tree in place
+    Only folders whose mtime changed are listed again, new folders are read
+    completely and removed folders are dropped from the tree and mtimes
+    Returns the number of folders that changed
+    '''
+    root_path = os.fspath(root_path)
+    skip = _skip_rule(prune)
+    lister = _list_dir_table if isinstance(file_tree, Node) else _list_dir
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        known = list(mtimes.keys())
+        current = pool.map(_dir_mtime, [os.path.join(root_path, *parts) for parts in known])
+        # parents first, so a removed parent drops its children before they are visited
+        changed = sorted(
+            (parts for parts, mtime in zip(known, current) if mtimes[parts] != mtime),
+            key=len,
+        )
+        if not changed:
+            return 0
+
+        listings = pool.map(lister, [os.path.join(root_path, *parts) for parts in changed])
+        removed = set()
+        new_dirs = []
+        for parts, (files, dirs, mtime) in zip(changed, listings):
+            if any(parts[:i] in removed for i in range(1, len(parts) + 1)):
+                continue # this folder or a parent was removed
+            if mtime is None and not parts:
+                raise FileNotFoundError(f"Project folder no longer exists: {root_path}")
+
+            node = file_tree
+            for part in parts:
+                node = node.child(part, load=False) if isinstance(node, Node) else node.get(part)
+                if node is None:
+                    break
+            if node is None or mtime is None:
+                # gone from disk, the parent listing drops it from the tree
+                removed.add(parts)
+                continue
+
+            mtimes[parts] = mtime
+            at_limit = max_depth is not None and len(parts) >= max_depth
+            if at_limit and not isinstance(node, Node):
+                dirs = []
+            dirs = [dirname for dirname in dirs if not skip(dirname)]
+            gone, added = _apply_listing(node, files, dirs, mtime)
+            removed.update(parts + (dirname,) for dirname in gone)
+            if not at_limit:
+                new_dirs.extend((parts + (dirname,), child) for dirname, child in added)
+
+        if removed:
+            for parts in [parts for parts in mtimes if any(parts[:i] in removed for i in range(1, len(parts) + 1))]:
+                del mtimes[parts]
+
+        _walk(pool, root_path, new_dirs, max_depth, skip, mtimes, lister)
+    return len(changed)
+
+# local snapshots of project structures, keyed by project path
+SNAPSHOT_DIR = os.environ.get(
+    "ELPAPI_SNAPSHOT_DIR", os.path.join(Path.home(), ".cache", "elPapi")
+)
+SNAPSHOT_VERSION = 4
+
+def snapshot_path(project_path) -> Path:
+    '''Returns the local snapshot file for a project path'''
+    key = os.path.normcase(os.path.abspath(os.fspath(project_path)))
+    digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+    return Path(SNAPSHOT_DIR, f"{digest}.pickle")
+
+def load_snapshot(project_path):
+    '''
+    Returns (file_tree, mtimes) saved for the project or None
+    a missing, old or unreadable snapshot is treated as no snapshot
+    '''
+    path = snapshot_path(project_path)
+    try:
+        with open(path, "rb") as f:
+            snapshot = pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        LOG.warning(f"Ignoring unreadable snapshot {path}: {e}")
+        return None
+
+    if snapshot.get("version") != SNAPSHOT_VERSION:
+        return None
+    if snapshot.get("project_path") != os.fspath(project_path):
+        return None
+    return snapshot["file_tree"], snapshot["mtimes"]
+
+def save_snapshot(project_path, file_tree, mtimes) -> Path:
+    '''Writes the snapshot next to the others, replacing the old one in a single step'''
+    path = snapshot_path(project_path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    snapshot = {
+        "version": SNAPSHOT_VERSION,
+        "project_path": os.fspath(project_path),
+        "file_tree": file_tree,
+        "mtimes": mtimes,
+    }
+    tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+    with open(tmp_path, "wb") as f:
+        pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+    return path
+
+_node_name = attrgetter("name")
+
+# name.0001.ext, the frame number is between the last two dots like prism's @.(frame)@
+_frame_pattern = re.compile(r"^(.+\.)(\d+)(\.[^.]+)$")
+MIN_SEQUENCE_FRAMES = 2 # fewer numbered files than this stay plain files
+# numbered files spread over more than this times their count stay plain files,
+# eg. backup.1.zip and backup.20000000.zip are no frame range
+MAX_SEQUENCE_SPREAD = 4
+_max_frame_digits = 18 # frame numbers fit the int64 array of FrameSequence.holes
+
+def collapse_sequences(names):
+    '''
+    Splits filenames into plain names and FrameSequences
+    apex_v0001.0001.jpg ... apex_v0001.0100.jpg becomes apex_v0001.####.jpg 1-100
+    '''
+    plain = []
+    groups = {}
+    for name in names:
+        # same as _frame_pattern, partitioning is a lot faster on millions of names
+        stem, dot, extension = name.rpartition(".")
+        head, dot2, frame = stem.rpartition(".")
+        if not (
+            dot and dot2 and head and extension and frame.isdigit() and frame.isascii()
+            and len(frame) <= _max_frame_digits
+        ):
+            plain.append(name)
+            continue
+        groups.setdefault((f"{head}.", f".{extension}"), []).append(frame)
+
+    sequences = []
+    for (head, tail), frames in groups.items():
+        padding = min(map(len, frames))
+        numbers = []
+        for frame in frames:
+            # only frames that can be written back exactly, eg. not 01 next to 0001
+            if len(frame) == padding or frame[0] != "0":
+                numbers.append(int(frame))
+            else:
+                plain.append(f"{head}{frame}{tail}")
+        if len(numbers) < MIN_SEQUENCE_FRAMES or max(numbers) - min(numbers) + 1 > len(numbers) * MAX_SEQUENCE_SPREAD:
+            plain.extend(f"{head}{number:0{padding}d}{tail}" for number in numbers)
+        else:
+            sequences.append(FrameSequence(head, tail, padding, numbers))
+    return plain, sequences
+
+class FileTable:
+    '''
+    Compact list of the filenames in one folder
+    numbered frames are collapsed into FrameSequences, the other names are
+    joined into one string with an array of offsets, instead of a str object
+    and a list slot per file
+
+    iterating gives every filename, frames included
+    '''
+    __slots__ = ("_names", "_offsets", "sequences")
+
+    def __init__(self, names=()):
+        names, sequences = collapse_sequences(names)
+        self._names = "\0".join(names)
+        self._offsets = array("I", accumulate((len(name) + 1 for name in names), initial=0))
+        self.sequences = tuple(sequences)
+
+    def names(self):
+        '''filenames that are not part of a sequence'''
+        if len(self._offsets) == 1:
+            return []
+        return self._names.split("\0")
+
+    def __len__(self):
+        return len(self._offsets) - 1 + sum(len(sequence) for sequence in self.sequences)
+
+    def __getitem__(self, index):
+        length = len(self)
+        if index < 0:
+            index += length
+        if not 0 <= index < length:
+            raise IndexError("FileTable index out of range")
+        plain = len(self._offsets) - 1
+        if index < plain:
+            return self._names[self._offsets[index]:self._offsets[index + 1] - 1]
+        index -= plain
+        for sequence in self.sequences:
+            if index < len(sequence):
+                return sequence[index]
+            index -= len(sequence)
+
+    def __iter__(self):
+        yield from self.names()
+        for sequence in self.sequences:
+            yield from sequence.filenames()
+
+    def __contains__(self, name):
+        names = self._names
+        if (
+            names == name
+            or names.startswith(name + "\0")
+            or names.endswith("\0" + name)
+            or f"\0{name}\0" in names
+        ):
+            return True
+        return any(name in sequence for sequence in self.sequences)
+
+    def __eq__(self, other):
+        if isinstance(other, FileTable):
+            return self._names == other._names and self.sequences == other.sequences
+        return list(self) == other
+
+    def __repr__(self):
+        return f"FileTable({self.names()!r}, sequences={list(self.sequences)!r})"
+
 class Node:
-    def __init__(self, path=None):
-        self.diskpath = Path(path) # path to the file/folder on disk
-        self.path = None # file/folder path relative to Project
-        self.name = None # name of folder/file       
-        self.pcore = None # original link to prism
-        self.below = None # children nodes
-        self.above = None # parent node
-
-    @abstractmethod
+    '''
+    A folder in the project
+    child folders are kept in a tuple sorted by name and files in a FileTable,
+    folder names are interned so names like Playblasts or v0001 are stored once
+
+    a node can be navigated like the dict from read_file_structure,
+    eg. node["03_Production"]["Assets"]["_files"]
+
+    a folder is listed on the first access to its children or files and
+    cached, refresh lists it again. the class of each child comes from the
+    relationships table, eg. the folders in a Media node are Identifiers
+    '''
+    __slots__ = ("name", "above", "below", "files", "mtime", "_root")
+
+    kind = "folder" # key in relationships
+    pcore = None # original link to prism
+
+    def __init__(self, path=None, above=None):
+        '''path is the folder on disk for a root node or the folder name below above'''
+        path = os.fspath(path) if path is not None else ""
+        self.above = above # parent node
+        self._root = path if above is None else None
+        self.name = sys.intern(Path(path).name if above is None else path) # name of folder/file
+        self.below = None # children nodes sorted by name, None until listed
+        self.files = FileTable()
+        self.mtime = None
+
+    @property
+    def loaded(self) -> bool:
+        return self.below is not None
+
+    def load(self):
+        '''Lists the folder if that has not happened yet'''
+        if self.below is None:
+            self.refresh()
+        return self
+
+    def refresh(self, recursive=False):
+        '''
+        Lists the folder again, children still on disk keep their cached listing
+        recursive also refreshes every child that was already listed
+        '''
+        files, dirs, mtime = _list_dir_table(self._ospath())
+        self.set_listing(files, dirs, mtime)
+        if recursive:
+            for node in self.below:
+                if node.loaded:
+                    node.refresh(recursive=True)
+        return self
+
+    def _child_class(self, name):
+        '''Node class for a child folder, from the relationships table'''
+        for kind in relationships.get(self.kind, []):
+            names = folders.get(kind)
+            if names is None or name in names:
+                return _node_classes.get(kind, Node)
+        return Node
+
+    @classmethod
+    def from_dict(cls, file_tree, path=None, above=None):
+        '''Builds a node tree from the nested dict of read_file_structure'''
+        node = cls(path, above)
+        node.set_listing(file_tree.get("_files", []), [])
+        node.below = tuple(sorted(
+            (
+                node._child_class(name).from_dict(child, name, node)
+                for name, child in file_tree.items() if name != "_files"
+            ),
+            key=_node_name,
+        ))
+        return node
+
+    def to_dict(self) -> dict:
+        '''Returns the nested dict read_file_structure would build for the listed folders'''
+        file_tree = {"_files": list(self.files)}
+        for child in self.below or ():
+            file_tree[child.name] = child.to_dict()
+        return file_tree
+
+    @property
+    def diskpath(self) -> Path:
+        '''path to the file/folder on disk'''
+        return Path(self._ospath())
+
+    @property
+    def path(self) -> str:
+        '''file/folder path relative to the root node, "/" for the root'''
+        return "/" + "/".join(self.parts())
+
+    def _ospath(self) -> str:
+        if self.above is None:
+            return self._root
+        return os.path.join(self.above._ospath(), self.name)
+
+    def parts(self) -> tuple:
+        '''names of the folders from the root node down to this one'''
+        parts = []
+        node = self
+        while node.above is not None:
+            parts.append(node.name)
+            node = node.above
+        return tuple(reversed(parts))
+
     def getParent(self):
-        pass
+        return self.above
 
-    @abstractmethod
     def getChildren(self):
-        pass
+        return list(self.load().below)
+
+    def getFiles(self):
+        '''files as Leafs, numbered frames as one FrameSequence each'''
+        self.load()
+        return [Leaf(name, self) for name in self.files.names()] + list(self.files.sequences)
+
+    def child(self, name, load=True):
+        '''
+        Returns the child folder called name or None
+        load=False only looks at what is already listed
+        '''
+        if load:
+            self.load()
+        below = self.below or ()
+        index = bisect_left(below, name, key=_node_name)
+        if index < len(below) and below[index].name == name:
+            return below[index]
+        return None
+
+    def walk(self):
+        '''Yields this node and every folder below it that is already listed, depth first'''
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            yield node
+            stack.extend(reversed(node.below or ()))
+
+    def set_listing(self, files, dirs, mtime=None):
+        '''
+        Replaces the files and child folders with a fresh listing
+        children still on disk are kept with everything below them,
+        new children are not listed yet
+        files is a list of names or a FileTable
+        returns (removed names, added [(name, node)])
+        '''
+        self.files = files if isinstance(files, FileTable) else FileTable(files)
+        self.mtime = mtime
+        for sequence in self.files.sequences:
+            sequence.above = self
+        existing = {node.name: node for node in self.below or ()}
+        below = []
+        added = []
+        for name in dirs:
+            node = existing.pop(name, None)
+            if node is None:
+                node = self._child_class(name)(name, self)
+                added.append((node.name, node))
+            below.append(node)
+        below.sort(key=_node_name)
+        self.below = tuple(below)
+        return list(existing), added
+
+    # dict style access, so code written against read_file_structure keeps working
+    def __getitem__(self, name):
+        if name == "_files":
+            return self.load().files
+        node = self.child(name)
+        if node is None:
+            raise KeyError(name)
+        return node
+
+    def get(self, name, default=None):
+        try:
+            return self[name]
+        except KeyError:
+            return default
+
+    def keys(self):
+        return ["_files"] + [node.name for node in self.load().below]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __contains__(self, name):
+        return name == "_files" or self.child(name) is not None
+
+    # the parent link is not pickled, it is restored by the parent
+    def __getstate__(self):
+        return (self.name, self._root, self.files, self.mtime, self.below)
+
+    def __setstate__(self, state):
+        self.name, self._root, self.files, self.mtime, self.below = state
+        self.above = None
+        for node in self.below or ():
+            node.above = self
+        for sequence in self.files.sequences:
+            sequence.above = self
 
     def __str__(self):
         return f"Node: {self.name}"
@@ -115,22 +677,282 @@ class Leaf(Node):
     a leaf is a node that has no children
     it is a file
     '''
-    def __init__(self, filepath):
-        super().__init__(filepath)
-        
-        # self.file = self.diskpath.name
-        self.extension = self.diskpath.suffix        
-        self.above = None    
-        del self.below    
+    __slots__ = ()
 
-    def filesize(self):
-        pass
+    def __init__(self, filepath, above=None):
+        '''filepath is the file on disk or the filename below above'''
+        filepath = os.fspath(filepath)
+        self.above = above
+        self._root = filepath if above is None else None
+        self.name = Path(filepath).name if above is None else filepath
+
+    @property
+    def extension(self) -> str:
+        return os.path.splitext(self.name)[1]
+
+    def getChildren(self):
+        return []
+
+    def filesize(self) -> int:
+        return os.path.getsize(self._ospath())
+
+    def __getstate__(self):
+        return (self.name, self._root)
+
+    def __setstate__(self, state):
+        self.name, self._root = state
+        self.above = None
+
+class FrameSequence(Leaf):
+    '''
+    a numbered file sequence collapsed into one leaf
+    eg. apex_v0001.####.jpg with the frame range 1-100 and the missing frames as holes,
+    holes are runs of missing frames stored flat as first, last, first, last...
+    '''
+    __slots__ = ("head", "tail", "padding", "first", "last", "holes")
+
+    def __init__(self, head, tail, padding, frames, above=None):
+        frames = sorted(frames)
+        self.head = head
+        self.tail = tail
+        self.padding = padding
+        self.first = frames[0]
+        self.last = frames[-1]
+        holes = array("q")
+        if len(frames) != self.last - self.first + 1:
+            for previous, frame in zip(frames, frames[1:]):
+                if frame > previous + 1:
+                    holes.extend((previous + 1, frame - 1))
+        self.holes = holes
+        super().__init__(self.pattern, above)
+
+    @property
+    def pattern(self) -> str:
+        '''filename with a # per digit of the frame number'''
+        return f"{self.head}{'#' * self.padding}{self.tail}"
+
+    @property
+    def frame_range(self) -> tuple:
+        return self.first, self.last
+
+    def _hole_runs(self):
+        holes = self.holes
+        return zip(holes[0::2], holes[1::2])
+
+    def frames(self):
+        '''Yields the frame numbers that exist on disk'''
+        frame = self.first
+        for first, last in self._hole_runs():
+            yield from range(frame, first)
+            frame = last + 1
+        yield from range(frame, self.last + 1)
+
+    def filename(self, frame) -> str:
+        return f"{self.head}{frame:0{self.padding}d}{self.tail}"
+
+    def filenames(self):
+        for frame in self.frames():
+            yield self.filename(frame)
+
+    def __len__(self):
+        missing = sum(last - first + 1 for first, last in self._hole_runs())
+        return self.last - self.first + 1 - missing
+
+    def __getitem__(self, index):
+        '''filename of the index'th existing frame'''
+        frame = self.first + index
+        for first, last in self._hole_runs():
+            if first > frame:
+                break
+            frame += last - first + 1
+        return self.filename(frame)
+
+    def __contains__(self, filename):
+        match = _frame_pattern.match(filename)
+        if match is None:
+            return False
+        head, frame, tail = match.groups()
+        if head != self.head or tail != self.tail or len(frame) < self.padding:
+            return False
+        number = int(frame)
+        return (
+            self.filename(number) == frame.join((head, tail))
+            and self.first <= number <= self.last
+            and not any(first <= number <= last for first, last in self._hole_runs())
+        )
+
+    def __eq__(self, other):
+        if not isinstance(other, FrameSequence):
+            return NotImplemented
+        return self.__getstate__() == other.__getstate__()
+
+    __hash__ = Leaf.__hash__
+
+    def filesize(self) -> int:
+        '''total size of the frames on disk'''
+        folder = os.path.dirname(self._ospath())
+        return sum(os.path.getsize(os.path.join(folder, name)) for name in self.filenames())
+
+    def __getstate__(self):
+        return (self.head, self.tail, self.padding, self.first, self.last, self.holes)
+
+    def __setstate__(self, state):
+        self.head, self.tail, self.padding, self.first, self.last, self.holes = state
+        self.name = self.pattern
+        self._root = self.name
+        self.above = None
+
+    def __str__(self):
+        return f"FrameSequence: {self.name} {self.first}-{self.last}"
     
 
+class EntityIndex(dict):
+    '''
+    fullname: node dict with a prefix trie for partial names
+    the trie holds the fullname and every part after a "/", lowercased,
+    so "sh_02" finds sq_010/sh_020 and "sq_010/" finds all its shots
+    '''
+    def __init__(self, entries=()):
+        super().__init__()
+        self._trie = {}
+        for fullname, node in dict(entries).items():
+            self[fullname] = node
+
+    @staticmethod
+    def _keys(fullname):
+        key = fullname.casefold()
+        yield key
+        start = key.find("/")
+        while start != -1:
+            yield key[start + 1:]
+            start = key.find("/", start + 1)
+
+    def __setitem__(self, fullname, node):
+        if fullname not in self:
+            for key in self._keys(fullname):
+                trie = self._trie
+                for char in key:
+                    trie = trie.setdefault(char, {})
+                trie.setdefault("", set()).add(fullname)
+        super().__setitem__(fullname, node)
+
+    def __delitem__(self, fullname):
+        super().__delitem__(fullname)
+        for key in self._keys(fullname):
+            nodes = [self._trie]
+            for char in key:
+                nodes.append(nodes[-1][char])
+            nodes[-1][""].discard(fullname)
+            if not nodes[-1][""]:
+                del nodes[-1][""]
+            # drop the branches left empty, from the bottom up
+            for depth in range(len(key), 0, -1):
+                if nodes[depth]:
+                    break
+                del nodes[depth - 1][key[depth - 1]]
+
+    def pop(self, fullname, *default):
+        if fullname in self:
+            node = self[fullname]
+            del self[fullname]
+            return node
+        if default:
+            return default[0]
+        raise KeyError(fullname)
+
+    def clear(self):
+        super().clear()
+        self._trie = {}
+
+    def update(self, *args, **kwargs):
+        for fullname, node in dict(*args, **kwargs).items():
+            self[fullname] = node
+
+    def setdefault(self, fullname, node=None):
+        if fullname not in self:
+            self[fullname] = node
+        return self[fullname]
+
+    def find(self, prefix, limit=None) -> list:
+        '''Returns the sorted fullnames with a part starting with prefix'''
+        trie = self._trie
+        for char in prefix.casefold():
+            trie = trie.get(char)
+            if trie is None:
+                return []
+        found = set()
+        stack = [trie]
+        while stack:
+            trie = stack.pop()
+            for char, value in trie.items():
+                if char == "":
+                    found.update(value)
+                else:
+                    stack.append(value)
+        return sorted(found)[:limit]
+
+class VersionIndex:
+    '''
+    Sorted version numbers of every (entity, mediaType, identifier)
+    entity is the ShotOrAsset node, the highest version is the last item
+    so latest() is a dict lookup. Entities are indexed one at a time, the
+    first time their versions are asked for
+    '''
+    def __init__(self):
+        self._versions = {} # key: sorted version numbers
+        self._keys = {} # entity: keys
+        self._entities = set() # entities whose media folders were read
+
+    def set_versions(self, key, versions):
+        self._versions[key] = sorted(set(versions))
+        self._keys.setdefault(key[0], set()).add(key)
+
+    def add(self, key, version):
+        versions = self._versions.get(key)
+        if versions is None:
+            self.set_versions(key, [version])
+        elif version not in versions:
+            insort(versions, version)
+
+    def mark_indexed(self, entity):
+        self._entities.add(entity)
+
+    def indexed(self, entity) -> bool:
+        return entity in self._entities
+
+    def drop_entity(self, entity):
+        self._entities.discard(entity)
+        for key in self._keys.pop(entity, ()):
+            del self._versions[key]
+
+    def clear(self):
+        self._versions.clear()
+        self._keys.clear()
+        self._entities.clear()
+
+    def versions(self, key) -> list:
+        return list(self._versions.get(key, ()))
+
+    def latest(self, key) -> int:
+        versions = self._versions.get(key)
+        return versions[-1] if versions else 0
+
+    def keys(self):
+        return self._versions.keys()
+
+    def __contains__(self, key):
+        return key in self._versions
+
+    def __len__(self):
+        return len(self._versions)
+
 class Project:
     '''
     Root object which holds the cached structure of the project
     Every object should hold a refernce to this project object?
+
+    folders are listed on first access, so looking up one asset only lists
+    the folders on its way, load_structure reads everything at once
     '''
     def __init__(self, path: str, prismcore=None):
         self.pcore = prismcore
@@ -139,11 +961,53 @@ class Project:
         self.diskpath = Path(path)
         self.name = self.diskpath.name      
         
-        # store key value pair as object.name, object
-        self._assetFolders = {}  
-        self._sequences = {}
-        self._assets = {}
-        self._shots = {}
+        # store key value pair as object.fullname, object
+        # filled as entities are found, get_asset adds to them too
+        self._assetFolders = EntityIndex()
+        self._sequences = EntityIndex()
+        self._assets = EntityIndex()
+        self._shots = EntityIndex()
+        self._loaded = set() # sections whose entities are all in the index
+
+        self.file_tree = Node(self.diskpath) # root Node, listed lazily
+        self._versions = VersionIndex()
+        self._lock = threading.RLock() # held while the tree or indexes change
+        self._watcher = None
+
+    def load_structure(self, use_snapshot=True, workers=None) -> Node:
+        '''
+        Loads the file structure of the project
+        The tree is kept in a local snapshot, on reload only the folders
+        whose mtime changed since the snapshot are listed again
+        '''
+        snapshot = load_snapshot(self.diskpath) if use_snapshot else None
+        if snapshot:
+            file_tree, mtimes = snapshot
+            changed = refresh_file_structure(self.diskpath, file_tree, mtimes, workers=workers)
+            LOG.debug(f"Loaded snapshot of {self.diskpath}, {changed} folders changed")
+        else:
+            mtimes = {}
+            file_tree = scan_tree(self.diskpath, workers=workers, mtimes=mtimes)
+            assert file_tree is not None, "Project path does not exist"
+            changed = len(mtimes)
+
+        if changed and use_snapshot:
+            save_snapshot(self.diskpath, file_tree, mtimes)
+
+        self._set_tree(file_tree)
+        return file_tree
+
+    def save_structure(self) -> Path:
+        '''Saves the folders listed so far to the snapshot, including the lazily listed ones'''
+        return save_snapshot(self.diskpath, self.file_tree, tree_mtimes(self.file_tree))
+
+    def _set_tree(self, file_tree):
+        with self._lock:
+            self.file_tree = file_tree
+            for index in [self._assetFolders, self._sequences, self._assets, self._shots]:
+                index.clear()
+            self._loaded.clear()
+            self._versions.clear()
 
     def parse_structure(self):
         '''
@@ -154,156 +1018,386 @@ class Project:
         self._load_shots()
 
     def get_shots(self):
-        if not self._shots:
-            self._load_assets()
-        return self._shots
+        with self._lock:
+            if "Shots" not in self._loaded:
+                self._load_shots()
+            return self._shots
     
     def get_assets(self):
-        if not self._assets:
-            self._load_assets()
-        return self._assets
+        with self._lock:
+            if "Assets" not in self._loaded:
+                self._load_assets()
+            return self._assets
+
+    def get_sequences(self):
+        with self._lock:
+            if "Shots" not in self._loaded:
+                self._load_shots()
+            return self._sequences
 
-    def _load_assets(self, fs):
+    def iter_entities(self, section=None, chunk_size=None):
         '''
-        Parses the filestructure dict to create asset objects
+        Yields shots and assets as they are found, Assets first then Shots
+        folders are listed as the generator is consumed, so the first entities
+        come back while the rest of a slow share is still unlisted and nothing
+        more is listed than was asked for. The indexes are filled along the way
+
+        section limits it to "Assets" or "Shots"
+        chunk_size yields lists of up to chunk_size entities instead
         '''
-        assert '00_Pipeline' in fs, "Project path does not exist"           
-
-        start_path = Path('03_Production', 'Assets')
-        assets_path = fs['03_Production']['Assets']
-        # print("assets_path", assets_path)
-        # any folder with the following is a shot or asset
-        lookfor = ["Export", "Playblasts", "Renders", "Scenefiles"]
-        shotOrAssets = []
-        seqOrFolder = []
-        
-        for folder in assets_path.keys():   
-            if folder == '_files':
-                continue         
-            
-            _is_shotOrAsset = False
-            _temp_folders= []
-            _temp_assets = []
-            for subfolder in assets_path[folder].keys():               
-                if subfolder == '_files':
-                    continue         
-                if subfolder in lookfor: 
-                    # if we hit lookfor already, then we are in a shallow shot without a sequence
-                    _is_shotOrAsset = True                        
-                    _temp_assets.append(folder)
-                    break
-                else:
-                    # otherwise we are in a sequence or assetfolder
-                    _temp_assets.append(f"{folder}/{subfolder}")
-            
-            if not _is_shotOrAsset:
-                _temp_folders.append(folder) # we only want to add this sequence once
+        sections = [section] if section else ["Assets", "Shots"]
+        entities = (entity for name in sections for entity in self._iter_section(name))
+        return chunked(entities, chunk_size) if chunk_size else entities
+
+    def iter_media(self, entities=None, media_type=None, chunk_size=None):
+        '''
+        Yields the identifier folders of every media type of every entity
+        entities defaults to iter_entities(), media_type limits it to one of media_types
+        '''
+        if entities is None:
+            entities = self.iter_entities()
+        identifiers = (
+            identifier for entity in entities
+            for identifier in self._iter_identifiers(entity, media_type)
+        )
+        return chunked(identifiers, chunk_size) if chunk_size else identifiers
+
+    def iter_versions(self, entities=None, media_type=None, chunk_size=None):
+        '''Yields the version folders (v0001) of every identifier iter_media finds'''
+        versions = (
+            version for identifier in self.iter_media(entities, media_type)
+            for version in self._list(identifier)
+            if _version_pattern.match(version.name)
+        )
+        return chunked(versions, chunk_size) if chunk_size else versions
 
-            seqOrFolder.extend(_temp_folders)
-            shotOrAssets.extend(_temp_assets)
-            print("aaa", _temp_assets, _temp_folders)
+    def _iter_section(self, name):
+        '''
+        Finds the entities below Assets or Shots one folder at a time
+        the lock is only held while a folder is listed, never across a yield
+        '''
+        entities, entity_folders = self._section_indexes(name)
+        with self._lock:
+            done = list(entities.values()) if name in self._loaded else None
+            section = None if done is not None else self._section(name)
+        if done is not None:
+            yield from done
+            return
 
-        # now we have this list, do we make an object per list?
-        # doesnt this mean another pointless loop?
+        folder_class = _folder_classes[name]
+        stack = [section] if section is not None else []
+        while stack:
+            node = stack.pop()
+            found = []
+            with self._lock:
+                folders = []
+                for child in node.getChildren():
+                    if _classify(child, folder_class) is ShotOrAsset:
+                        entities[child.fullname] = child
+                        found.append(child)
+                    else:
+                        entity_folders[child.fullname] = child
+                        folders.append(child)
+            stack.extend(reversed(folders))
+            yield from found
 
-        # next we need to create the objects
-        # and look at what each object needs to be useful as an object with this fs
-        # the filepath can be inferred on request 
-        # we want to limit any IO calls to a minimum
-        # we want to cache as much as possible
+        with self._lock:
+            self._loaded.add(name)
 
-        # do we need objects for both AssetFolders and Assets
-        # do we want objects for every single thing that is visible in the prism browser?
+    def _iter_identifiers(self, entity, media_type=None):
+        for media_parts, known_type in media_types.items():
+            if media_type is not None and known_type != media_type:
+                continue
+            with self._lock:
+                media = entity
+                for part in media_parts:
+                    media = media.child(part)
+                    if media is None:
+                        break
+                identifiers = media.getChildren() if media is not None else []
+            yield from identifiers
 
-        print("seqOrFolder", seqOrFolder)
-        print("shotOrAssets", shotOrAssets)
-                
+    def _list(self, node) -> list:
+        with self._lock:
+            return node.getChildren()
 
-    def _load_assets_disk(self):
-        # maybe these should be generators?
-        assert self.diskpath.exists(), "Project path does not exist"
-        assert isinstance(self.diskpath, Path), "diskpath must be a Path object"
-
-        assets_path = self.diskpath.joinpath("03_Production","Assets")
-        assert assets_path.exists(), "Assets path does not exist"   
-
-        # any folder with the following is a shot or asset
-        lookfor = ["Export", "Playblasts", "Renders", "Scenefiles"]
-        shotOrAssets = []
-        seqOrFolder = []
-        if assets_path.exists():
-            for folder in assets_path.iterdir():
-                if folder.is_dir():
-                    is_shotOrAsset = False
-                    _temp_assets = []
-                    for subfolder in folder.iterdir():                        
-                        if subfolder.name in lookfor:
-                            is_shotOrAsset = True
-                            break
-                        else:
-                            _temp_assets.append(subfolder)
-                    
-                    if is_shotOrAsset:                    
-                        shotOrAssets.append(folder)
+    def get_asset(self, fullname):
+        '''Returns the asset called fullname (eg. assetfolder/inside) or None'''
+        return self._get_entity("Assets", fullname, self._assets)
+
+    def get_shot(self, fullname):
+        '''Returns the shot called fullname (eg. sq_010/sh_020) or None'''
+        return self._get_entity("Shots", fullname, self._shots)
+
+    def find_assets(self, prefix, limit=None) -> list:
+        '''Fullnames of the assets with a part starting with prefix, eg. "tan" finds vehicles/Tank'''
+        with self._lock:
+            return self.get_assets().find(prefix, limit)
+
+    def find_shots(self, prefix, limit=None) -> list:
+        '''Fullnames of the shots with a part starting with prefix, eg. "sh_02" finds sq_010/sh_020'''
+        with self._lock:
+            return self.get_shots().find(prefix, limit)
+
+    def _section(self, name):
+        '''Returns the Assets or Shots node'''
+        production = self.file_tree.child("03_Production")
+        if production is None:
+            return None
+        return production.child(name)
+
+    def _get_entity(self, section, fullname, index):
+        fullname = fullname.replace("\\", "/")
+        with self._lock:
+            node = index.get(fullname)
+            if node is not None:
+                return node
+
+            node = self._section(section)
+            for part in fullname.split("/"):
+                if node is None:
+                    return None
+                node = node.child(part)
+            if node is None or _classify(node, _folder_classes[section]) is not ShotOrAsset:
+                return None
+            index[node.fullname] = node
+            return node
+
+    def _section_indexes(self, section):
+        '''(entities, entity folders) for Assets or Shots'''
+        if section == "Assets":
+            return self._assets, self._assetFolders
+        return self._shots, self._sequences
+
+    def refresh_node(self, node):
+        '''
+        Lists node again and patches the indexes with what changed
+        used by the watcher, returns (removed names, added [(name, node)])
+        '''
+        with self._lock:
+            files, dirs, mtime = _list_dir_table(node._ospath())
+            if mtime is None:
+                return [], [] # gone, the listing of its parent drops it
+            removed, added = node.set_listing(files, dirs, mtime)
+            self._patch_indexes(node, removed, added)
+            return removed, added
+
+    def _patch_indexes(self, node, removed, added):
+        parts = node.parts()
+        if len(parts) < 2 or parts[0] != "03_Production" or parts[1] not in _folder_classes:
+            return
+        section = parts[1]
+        folder_class = _folder_classes[section]
+        entities, entity_folders = self._section_indexes(section)
+
+        if len(parts) > 2:
+            # trees from scan_tree or a snapshot hold plain Nodes until they are
+            # classified, so the folders above node are classified top down
+            ancestors = []
+            ancestor = node.above
+            while len(ancestor.parts()) > 2:
+                ancestors.append(ancestor)
+                ancestor = ancestor.above
+            for ancestor in reversed(ancestors):
+                if type(ancestor) is Node:
+                    if _classify(ancestor, folder_class) is ShotOrAsset:
+                        entities.setdefault(_entity_fullname(ancestor), ancestor)
                     else:
-                        # folder is seq/assetfolder
-                        # subfolder is shot/asset
-
-                        # we need to add the shots with the sequence as parent
-                        seqOrFolder.append(folder)
-                        shotOrAssets
-                        
-                        
-                        
-            
-
-            return [
-                ShotOrAsset(asset_path, self.pcore)
-                for asset_path in assets_path.iterdir()
-                if asset_path.is_dir()
-            ]
-        
+                        entity_folders.setdefault(_entity_fullname(ancestor), ancestor)
+                if isinstance(ancestor, ShotOrAsset):
+                    # inside an entity, only the media versions can change
+                    if self._versions.indexed(ancestor) and len(parts) - len(ancestor.parts()) <= _media_depth:
+                        self._index_entity_versions(ancestor)
+                    return
 
-    def get_sequences(self):
-        if self._sequences is None:
-            self._sequences = self._load_sequences()
-        return self._sequences
-
-    def _load_shots(self):
-        sequences_path = self.path / "03_Production" / "Shots" / "Sequences"
-        if sequences_path.exists():
-            return [
-                Sequence(sequence_path, self.pcore)
-                for sequence_path in sequences_path.iterdir()
-                if sequence_path.is_dir()
-            ]
-        return [] 
+            # the node may have become an entity or stopped being one
+            fullname = _entity_fullname(node)
+            was_entity = isinstance(node, ShotOrAsset)
+            is_entity = _classify(node, folder_class) is ShotOrAsset
+            if was_entity != is_entity:
+                self._drop_versions(_drop_entries(fullname, entities, entity_folders))
+                if is_entity:
+                    entities[fullname] = node
+                else:
+                    entity_folders[fullname] = node
+                    _find_entities(node, folder_class, entities, entity_folders)
+                return
+            if is_entity:
+                entities.setdefault(fullname, node)
+                if self._versions.indexed(node):
+                    self._index_entity_versions(node)
+                return
+            entity_folders.setdefault(fullname, node)
+
+        # the section or an entity folder, its children changed
+        prefix = f"{_entity_fullname(node)}/" if len(parts) > 2 else ""
+        for name in removed:
+            self._drop_versions(_drop_entries(prefix + name, entities, entity_folders))
+        for name, child in added:
+            if _classify(child, folder_class) is ShotOrAsset:
+                entities[child.fullname] = child
+            else:
+                entity_folders[child.fullname] = child
+                _find_entities(child, folder_class, entities, entity_folders)
+
+    def build_version_index(self):
+        '''
+        Reads the versions of every media identifier of every entity in one pass
+        lookups index entities on demand, this is for tools that want them all up front
+        '''
+        with self._lock:
+            self._versions.clear()
+            for entity in list(self.get_assets().values()) + list(self.get_shots().values()):
+                self._index_entity_versions(entity)
+        return self._versions
+
+    def _index_entity_versions(self, entity):
+        self._versions.drop_entity(entity)
+        self._versions.mark_indexed(entity)
+        for media_parts, media_type in media_types.items():
+            media = entity
+            for part in media_parts:
+                media = media.child(part)
+                if media is None:
+                    break
+            if media is None:
+                continue
+            for identifier in media.getChildren():
+                self._versions.set_versions(
+                    (entity, media_type, identifier.name), _folder_versions(identifier)
+                )
+
+    def _drop_versions(self, nodes):
+        for node in nodes:
+            self._versions.drop_entity(node)
+
+    def get_versions(self, entity, media_type="playblasts", identifier="") -> list:
+        '''Sorted version numbers of an entity's media identifier'''
+        with self._lock:
+            self._refresh_media(entity, media_type, identifier)
+            return self._versions.versions((entity, media_type, identifier))
+
+    def latest_version(self, entity, media_type="playblasts", identifier="") -> int:
+        '''
+        Highest version of an entity's media identifier, 0 if there is none
+        a dict lookup once the entity is indexed, the entity, media and identifier
+        folders are stat'ed so versions written by others since are picked up
+        '''
+        with self._lock:
+            self._refresh_media(entity, media_type, identifier)
+            return self._versions.latest((entity, media_type, identifier))
+
+    def _refresh_media(self, entity, media_type, identifier):
+        '''
+        Lists the entity, media and identifier folders again when their mtime
+        changed, the entity too as its first Playblasts folder may be new.
+        Indexes the entity if that has not happened yet
+        '''
+        for media_parts, known_type in media_types.items():
+            if known_type != media_type:
+                continue
+            node = entity
+            for part in (None, *media_parts, identifier):
+                if part is not None:
+                    node = node.child(part)
+                    if node is None:
+                        break
+                if node.loaded and node.mtime != _dir_mtime(node._ospath()):
+                    self.refresh_node(node)
+        if not self._versions.indexed(entity):
+            self._index_entity_versions(entity)
+
+    def watch(self, interval=5.0, polling=None):
+        '''
+        Starts a background watcher that keeps the tree and indexes current
+        inotify on linux, polling every interval seconds elsewhere or when polling=True
+        '''
+        import watcher
+        self.stop_watching()
+        self._watcher = watcher.watch(self, interval=interval, polling=polling)
+        return self._watcher
+
+    def stop_watching(self):
+        if self._watcher is not None:
+            self._watcher.stop()
+            self._watcher = None
+
+    def _load_assets(self, fs=None):
+        '''
+        Finds the assets and asset folders below 03_Production/Assets
+        fs is an optional nested dict from read_file_structure to use instead of the disk
+        '''
+        if fs is not None:
+            assert '00_Pipeline' in fs, "Project path does not exist"
+            self._set_tree(Node.from_dict(fs, self.diskpath))
+
+        with self._lock:
+            assert self._section("Assets") is not None, "Assets path does not exist"
+            self._assets.clear()
+            self._assetFolders.clear()
+            self._loaded.discard("Assets")
+            for _ in self._iter_section("Assets"):
+                pass
+
+    def _load_shots(self, fs=None):
+        '''
+        Finds the shots and sequences below 03_Production/Shots
+        fs is an optional nested dict from read_file_structure to use instead of the disk
+        '''
+        if fs is not None:
+            assert '00_Pipeline' in fs, "Project path does not exist"
+            self._set_tree(Node.from_dict(fs, self.diskpath))
+
+        with self._lock:
+            self._shots.clear()
+            self._sequences.clear()
+            self._loaded.discard("Shots")
+            for _ in self._iter_section("Shots"):
+                pass
+
+    def _load_assets_disk(self):
+        '''Assets read straight from the disk, use iter_entities("Assets") instead'''
+        return list(self.iter_entities("Assets"))
 
     def __str__(self):
         return f"Project: {self.name}"
 
-class Sequence(Node):
-    def __init__(self, path: str, prismcore):
-        super().__init__(path, prismcore)
-        self.name = self.path.name        
-        self.pcore = prismcore
+class SequenceOrAssetFolder(Node): # also known as entityfolder
+    '''a folder of entities, sequence below Shots or assetfolder below Assets'''
+    __slots__ = ()
+    kind = "entityfolder"
+
+    @property
+    def type(self) -> str:
+        return "sequence" if _entity_section(self) == "Shots" else "assetfolder"
+
+    @property
+    def fullname(self) -> str:
+        return _entity_fullname(self)
+
+
+class Sequence(SequenceOrAssetFolder):
+    __slots__ = ()
 
     def getShots(self):
-        pass    
+        return [node for node in self.getChildren() if _classify(node, Sequence) is ShotOrAsset]
 
     def __str__(self):
         return f"Sequence: {self.name}"
 
 
 class ShotOrAsset(Node): # also known as entity?
-    def __init__(self, path: str, type: str=""):        
-        super().__init__(path)
-        self.name = self.path.name
-        self.fullname = self.name
-        if self.above: # if we have a parent
-            self.fullname = f"{self.above.name}/{self.name}"  # parent/child
-            
-        self.type = type
+    __slots__ = ()
+    kind = "entity"
+
+    @property
+    def type(self) -> str:
+        return "shot" if _entity_section(self) == "Shots" else "asset"
+
+    @property
+    def fullname(self) -> str:
+        '''parent/child, eg. assetfolder/inside or sq_010/sh_020'''
+        return _entity_fullname(self)
 
     def getSequence(self):
         if self.type == "shot":
@@ -314,18 +1408,125 @@ class ShotOrAsset(Node): # also known as entity?
     
     def getDepartments(self):
         pass
-         
-
-class SequenceOrAssetFolder(Node): # also known as entity?
-    def __init__(self, path: str, type: str=""):        
-        super().__init__(path)
-        self.name = self.path.name
-        self.fullname = self.name
-        if self.above: # if we have a parent
-            self.fullname = f"{self.above.name}/{self.name}"  # parent/child
-            
-        assert type in ["sequence", "assetfolder"], "type must be sequence or assetfolder"
-        self.type = type
+
+    def getMedia(self):
+        '''Playblasts and Renders folders'''
+        return [node for node in self.getChildren() if isinstance(node, Media)]
+
+
+class Media(Node): # Playblasts or Renders
+    __slots__ = ()
+    kind = "media"
+
+    def getIdentifiers(self):
+        return self.getChildren()
+
+
+class Identifier(Node):
+    __slots__ = ()
+    kind = "identifier"
+
+
+# node classes for the kinds in relationships, the others are plain Nodes
+_node_classes = {
+    "entity": ShotOrAsset,
+    "media": Media,
+    "identifier": Identifier,
+}
+
+# media folders of an entity and their prism mediaType, identifiers are the folders inside
+media_types = {
+    ("Playblasts",): "playblasts",
+    ("Renders", "3dRender"): "3drenders",
+    ("Renders", "2dRender"): "2drenders",
+}
+# deepest folder below an entity whose listing holds versions
+_media_depth = max(len(parts) for parts in media_types) + 1
+_version_pattern = re.compile(r"^v(\d+)")
+
+# class of the folders holding entities, below Assets and Shots
+_folder_classes = {
+    "Assets": SequenceOrAssetFolder,
+    "Shots": Sequence,
+}
+
+# any folder containing one of these is a shot or asset
+ENTITY_FOLDERS = frozenset(name for names in folders.values() for name in names)
+
+def _entity_section(node) -> str:
+    '''Assets or Shots, the folder below 03_Production the node is in'''
+    parts = node.parts()
+    return parts[1] if len(parts) > 1 else ""
+
+def _entity_fullname(node) -> str:
+    return "/".join(node.parts()[2:])
+
+def _promote(node, cls):
+    '''
+    Changes the class of a listed node once we know what it is
+    children that are already listed get their class from the relationships table
+    '''
+    if type(node) is cls:
+        return
+    node.__class__ = cls
+    for child in node.below or ():
+        _promote(child, node._child_class(child.name))
+
+def _classify(node, folder_class):
+    '''
+    Lists the node and promotes it to ShotOrAsset when it contains one of
+    ENTITY_FOLDERS, otherwise to folder_class, returns the new class
+    '''
+    if any(child.name in ENTITY_FOLDERS for child in node.getChildren()):
+        _promote(node, ShotOrAsset)
+    else:
+        _promote(node, folder_class)
+    return type(node)
+
+def _find_entities(node, folder_class, entities, entity_folders):
+    '''Fills the dicts with fullname: node for every entity and entityfolder below node'''
+    for child in node.getChildren():
+        if _classify(child, folder_class) is ShotOrAsset:
+            entities[child.fullname] = child
+        else:
+            entity_folders[child.fullname] = child
+            _find_entities(child, folder_class, entities, entity_folders)
+
+def _drop_entries(fullname, *indexes) -> list:
+    '''Removes fullname and everything below it from the indexes, returns the removed nodes'''
+    removed = []
+    for index in indexes:
+        if fullname in index:
+            removed.append(index.pop(fullname))
+        prefix = f"{fullname}/"
+        for name in index.find(prefix):
+            if name.startswith(prefix):
+                removed.append(index.pop(name))
+    return removed
+
+def _folder_versions(identifier) -> list:
+    '''Version numbers of the version folders (v0001) in an identifier folder'''
+    versions = []
+    for node in identifier.getChildren():
+        match = _version_pattern.match(node.name)
+        if match:
+            versions.append(int(match.group(1)))
+    return versions
+
+def chunked(iterable, size):
+    '''Yields lists of up to size items, the last one can be shorter'''
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def tree_mtimes(root) -> dict:
+    '''{path parts: mtime_ns} of every listed folder in a Node tree'''
+    return {node.parts(): node.mtime for node in root.walk() if node.loaded}
 
 
 '''
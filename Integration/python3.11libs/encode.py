@@ -0,0 +1,428 @@
+'''
+Runs ffmpeg without blocking and reports its progress
+
+ffmpeg is started with -progress pipe:1, it then writes blocks of key=value
+lines to stdout, each ending with progress=continue or progress=end.
+stderr is read at the same time so a chatty encode never fills the pipe
+
+FrameStream pipes images into ffmpeg as they are made, so no image
+sequence has to be written first.
+
+long sequences can be encoded in chunks, each chunk is its own ffmpeg
+process starting on a keyframe, the segments are then joined without
+encoding again by the concat demuxer
+
+the encoder settings come from profiles, each has speed tiers:
+preview for quick dailies, review for the default, archive for slow best quality
+
+usage:
+    result = encode.run_ffmpeg(command, on_progress=print, total_frames=240)
+    result.returncode
+
+    encode.get_profile("h265").args("preview")
+'''
+
+import os
+import re
+import glob
+import queue
+import asyncio
+import logging
+import threading
+import subprocess
+
+LOG = logging.getLogger(__name__)
+
+_frame_token = re.compile(r"\$F(\d*)")
+
+TIERS = ("preview", "review", "archive")
+DEFAULT_PROFILE = "av1"
+DEFAULT_TIER = "review"
+# options for the container rather than the encoder, they hold for a stream copy too
+REMUX_OPTIONS = ("-tag:v", "-movflags", "-brand")
+
+
+class Profile:
+    '''
+    ffmpeg encoder settings for one codec
+    options apply to every tier, tiers maps each of TIERS to its own options
+    options are {flag: value}, eg. {"-crf": 30}
+    '''
+    def __init__(self, name, label, encoder, extension, options, tiers):
+        self.name = name
+        self.label = label
+        self.encoder = encoder
+        self.extension = extension
+        self.options = options
+        self.tiers = tiers
+
+    def args(self, tier=DEFAULT_TIER) -> str:
+        '''The ffmpeg output options for tier'''
+        if tier not in self.tiers:
+            raise ValueError(f"{self.name} has no tier {tier}, expected one of {', '.join(self.tiers)}")
+        options = {"-c:v": self.encoder, **self.options, **self.tiers[tier]}
+        return " ".join(f"{flag} {value}" for flag, value in options.items())
+
+    def remux_args(self, tier=DEFAULT_TIER) -> str:
+        '''The options of args that still apply when the stream is copied, eg. joining chunks'''
+        options = {**self.options, **self.tiers.get(tier, {})}
+        return " ".join(f"{flag} {value}" for flag, value in options.items() if flag in REMUX_OPTIONS)
+
+    def __str__(self):
+        return self.label
+
+
+PROFILES = {}
+
+def register_profile(profile):
+    '''Adds a profile, replacing one with the same name'''
+    PROFILES[profile.name] = profile
+    return profile
+
+def get_profile(name=None) -> Profile:
+    name = name or DEFAULT_PROFILE
+    if name not in PROFILES:
+        raise ValueError(f"Unknown encoder profile {name}, expected one of {', '.join(PROFILES)}")
+    return PROFILES[name]
+
+
+# -threads 0 lets the encoder pick, chunked encodes run several processes so
+# the row/tile threading matters more than the process count
+register_profile(Profile(
+    "av1", "AV1 libaom (webm)", "libaom-av1", ".webm",
+    # -b:v 0 with -crf is constant quality, -row-mt and -tiles let libaom use more cores
+    {"-pix_fmt": "yuv420p", "-b:v": 0, "-row-mt": 1, "-threads": 0},
+    {
+        "preview": {"-usage": "realtime", "-cpu-used": 8, "-tiles": "2x2", "-crf": 40},
+        "review": {"-cpu-used": 6, "-tiles": "2x2", "-crf": 30},
+        "archive": {"-cpu-used": 3, "-tiles": "1x1", "-crf": 22},
+    },
+))
+register_profile(Profile(
+    "av1_svt", "AV1 SVT (webm)", "libsvtav1", ".webm",
+    {"-pix_fmt": "yuv420p"},
+    {
+        "preview": {"-preset": 12, "-crf": 40},
+        "review": {"-preset": 8, "-crf": 32},
+        "archive": {"-preset": 4, "-crf": 24},
+    },
+))
+register_profile(Profile(
+    "h265", "H265 (mp4)", "libx265", ".mp4",
+    # hvc1 so quicktime and the browsers play it
+    {"-pix_fmt": "yuv420p", "-tag:v": "hvc1", "-x265-params": "log-level=error", "-threads": 0},
+    {
+        "preview": {"-preset": "ultrafast", "-crf": 30},
+        "review": {"-preset": "medium", "-crf": 24},
+        "archive": {"-preset": "slow", "-crf": 18},
+    },
+))
+register_profile(Profile(
+    "h264", "H264 (mp4)", "libx264", ".mp4",
+    {"-pix_fmt": "yuv420p", "-threads": 0},
+    {
+        "preview": {"-preset": "ultrafast", "-crf": 26},
+        "review": {"-preset": "medium", "-crf": 20},
+        "archive": {"-preset": "slow", "-crf": 16},
+    },
+))
+register_profile(Profile(
+    "prores_proxy", "ProRes Proxy (mov)", "prores_ks", ".mov",
+    # profile 0 is proxy, qscale trades size for quality within it
+    {"-profile:v": 0, "-vendor": "apl0", "-pix_fmt": "yuv422p10le", "-threads": 0},
+    {
+        "preview": {"-qscale:v": 13},
+        "review": {"-qscale:v": 9},
+        "archive": {"-qscale:v": 4},
+    },
+))
+
+
+class Progress:
+    '''One progress block of ffmpeg'''
+    def __init__(self, values: dict, total_frames=None):
+        self.values = values
+        self.total_frames = total_frames
+
+    @property
+    def frame(self) -> int:
+        return int(self.values.get("frame", 0) or 0)
+
+    @property
+    def fps(self) -> float:
+        return _float(self.values.get("fps"))
+
+    @property
+    def speed(self) -> float:
+        '''times realtime, ffmpeg reports it as 2.5x'''
+        return _float(self.values.get("speed", "").rstrip("x"))
+
+    @property
+    def done(self) -> bool:
+        return self.values.get("progress") == "end"
+
+    @property
+    def fraction(self):
+        '''0 to 1, None when the frame count is not known'''
+        if not self.total_frames:
+            return None
+        return min(self.frame / self.total_frames, 1.0)
+
+    def __str__(self):
+        frames = f"{self.frame}/{self.total_frames}" if self.total_frames else f"{self.frame}"
+        return f"Frame {frames}, {self.fps:.1f} fps, {self.speed:.2f}x"
+
+
+def _float(value) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0 # N/A before the first frame
+
+
+def parse_progress(lines, total_frames=None):
+    '''Yields a Progress for every block of key=value lines'''
+    values = {}
+    for line in lines:
+        progress = _feed(values, line, total_frames)
+        if progress is not None:
+            yield progress
+
+def _feed(values, line, total_frames):
+    '''Adds a line to the block in values, returns a Progress once the block ends'''
+    key, sep, value = line.strip().partition("=")
+    if not sep:
+        return None
+    values[key] = value
+    if key != "progress":
+        return None
+    progress = Progress(dict(values), total_frames)
+    values.clear()
+    return progress
+
+
+def chunk_ranges(first, last, chunks, min_frames=24) -> list:
+    '''
+    Splits the frame range first-last (inclusive) into up to chunks ranges
+    of at least min_frames each, returns [(first, last), ...]
+    '''
+    total = last - first + 1
+    chunks = max(1, min(chunks, total // max(min_frames, 1)))
+    size, extra = divmod(total, chunks)
+    ranges = []
+    start = first
+    for i in range(chunks):
+        end = start + size + (1 if i < extra else 0) - 1
+        ranges.append((start, end))
+        start = end + 1
+    return ranges
+
+
+def segment_path(outputpath, index) -> str:
+    '''Path of chunk index of an encode, mkv holds any codec the final container can'''
+    root, _ = os.path.splitext(str(outputpath))
+    return f"{root}.part{index:03d}.mkv"
+
+
+def write_concat_list(segments, listpath):
+    '''Writes the file list the concat demuxer reads, paths are quoted for it'''
+    with open(listpath, "w") as f:
+        for segment in segments:
+            path = os.path.abspath(segment).replace("\\", "/").replace("'", "'\\''")
+            f.write(f"file '{path}'\n")
+
+
+def sequence_frames(inputpath) -> dict:
+    '''
+    {frame: os.stat_result} of the files of a $F4 style sequence path
+    one listing of the folder, not a stat per possible frame
+    '''
+    folder, name = os.path.split(str(inputpath))
+    match = _frame_token.search(name)
+    if match is None:
+        raise ValueError(f"No $F frame token in {inputpath}")
+    pattern = re.compile(
+        re.escape(name[:match.start()]) + r"(-?\d+)" + re.escape(name[match.end():]) + "$"
+    )
+    frames = {}
+    try:
+        entries = os.scandir(folder or ".")
+    except FileNotFoundError:
+        return frames
+    with entries:
+        for entry in entries:
+            found = pattern.match(entry.name)
+            if found and entry.is_file():
+                frames[int(found.group(1))] = entry.stat()
+    return frames
+
+
+def frame_path(inputpath, frame) -> str:
+    '''The file of frame in a $F4 style sequence path'''
+    return _frame_token.sub(lambda m: f"{frame:0{int(m.group(1) or 1)}d}", str(inputpath), count=1)
+
+
+def missing_ranges(frames: dict, first, last) -> list:
+    '''[(first, last), ...] of the frames in first-last missing from frames or empty on disk'''
+    ranges = []
+    start = None
+    for frame in range(first, last + 2):
+        stat = frames.get(frame)
+        missing = frame <= last and (stat is None or stat.st_size == 0)
+        if missing and start is None:
+            start = frame
+        elif not missing and start is not None:
+            ranges.append((start, frame - 1))
+            start = None
+    return ranges
+
+
+def is_up_to_date(outputpath, inputpath, frames=None) -> bool:
+    '''Whether outputpath is newer than every frame of the sequence, frames limits it to [first, last]'''
+    try:
+        output_mtime = os.stat(outputpath).st_mtime_ns
+    except OSError:
+        return False
+    found = sequence_frames(inputpath)
+    if frames:
+        first, last = frames
+        if any(frame not in found for frame in range(first, last + 1)):
+            return False
+        found = {frame: stat for frame, stat in found.items() if first <= frame <= last}
+    if not found:
+        return False
+    return all(stat.st_mtime_ns < output_mtime for stat in found.values())
+
+
+def count_frames(inputpath) -> int:
+    '''Number of files on disk matching a $F4 style sequence path'''
+    pattern = _frame_token.sub(lambda m: "[0-9]" * int(m.group(1) or 1), glob.escape(str(inputpath)))
+    return len(glob.glob(pattern))
+
+
+async def run_ffmpeg_async(command, on_progress=None, total_frames=None, cancel=None):
+    '''
+    Runs an ffmpeg command line that writes -progress pipe:1
+    on_progress(Progress) is called for every block, cancel is an optional
+    threading.Event that stops the encode. Returns a CompletedProcess
+    '''
+    process = await asyncio.create_subprocess_shell(
+        command, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+    )
+
+    async def read_progress():
+        values = {}
+        async for raw in process.stdout:
+            progress = _feed(values, raw.decode(errors="replace"), total_frames)
+            if progress is not None and on_progress:
+                on_progress(progress)
+
+    async def watch_cancel():
+        while process.returncode is None:
+            if cancel.is_set():
+                LOG.info(f"Cancelling encode: {command}")
+                process.terminate()
+                return
+            await asyncio.sleep(0.2)
+
+    tasks = [asyncio.ensure_future(read_progress()), asyncio.ensure_future(process.stderr.read())]
+    watcher = asyncio.ensure_future(watch_cancel()) if cancel is not None else None
+    try:
+        _, stderr = await asyncio.gather(*tasks)
+        returncode = await process.wait()
+    finally:
+        if watcher is not None:
+            watcher.cancel()
+    return subprocess.CompletedProcess(command, returncode, None, stderr.decode(errors="replace"))
+
+
+def run_ffmpeg(command, on_progress=None, total_frames=None, cancel=None):
+    '''run_ffmpeg_async on its own event loop, for worker threads'''
+    return asyncio.run(run_ffmpeg_async(command, on_progress, total_frames, cancel))
+
+
+# ffmpeg demuxers that read back to back images of one format from a pipe
+PIPE_DEMUXERS = {
+    ".jpg": "jpeg_pipe",
+    ".jpeg": "jpeg_pipe",
+    ".png": "png_pipe",
+    ".exr": "exr_pipe",
+    ".tif": "tiff_pipe",
+    ".tiff": "tiff_pipe",
+    ".dpx": "dpx_pipe",
+}
+
+def pipe_demuxer(extension) -> str:
+    return PIPE_DEMUXERS.get(extension.lower(), "image2pipe")
+
+
+class FrameStream:
+    '''
+    Feeds encoded images to an ffmpeg reading them from stdin
+    feed() hands a frame to a writer thread and only blocks when queue_size
+    frames are waiting, so frames are made while ffmpeg encodes the previous ones
+
+    usage:
+        stream = FrameStream(command, on_progress=print, total_frames=100)
+        for data in frames:
+            stream.feed(data)
+        result = stream.close()
+    '''
+    def __init__(self, command, on_progress=None, total_frames=None, queue_size=8):
+        self.command = command
+        self.process = subprocess.Popen(
+            command, shell=True, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+        )
+        self._frames = queue.Queue(maxsize=queue_size)
+        self._stderr = []
+        self._error = None
+        self._threads = [
+            threading.Thread(target=self._write, daemon=True),
+            threading.Thread(target=self._read_progress, args=(on_progress, total_frames), daemon=True),
+            threading.Thread(target=lambda: self._stderr.append(self.process.stderr.read()), daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def feed(self, data: bytes):
+        if self._error is not None:
+            raise self._error
+        self._frames.put(data)
+
+    def close(self) -> subprocess.CompletedProcess:
+        '''Waits for the queued frames to be encoded, returns a CompletedProcess'''
+        self._frames.put(None)
+        for thread in self._threads:
+            thread.join()
+        returncode = self.process.wait()
+        stderr = b"".join(self._stderr).decode(errors="replace")
+        return subprocess.CompletedProcess(self.command, returncode, None, stderr)
+
+    def terminate(self):
+        self.process.terminate()
+        return self.close()
+
+    def _write(self):
+        stdin = self.process.stdin
+        try:
+            while True:
+                data = self._frames.get()
+                if data is None:
+                    break
+                stdin.write(data)
+        except OSError as e:
+            self._error = e # ffmpeg quit, its stderr says why
+            while self._frames.get() is not None:
+                pass # unblock feed until close
+        finally:
+            try:
+                stdin.close()
+            except OSError:
+                pass
+
+    def _read_progress(self, on_progress, total_frames):
+        values = {}
+        for raw in self.process.stdout:
+            progress = _feed(values, raw.decode(errors="replace"), total_frames)
+            if progress is not None and on_progress:
+                on_progress(progress)
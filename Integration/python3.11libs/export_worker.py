@@ -0,0 +1,220 @@
+'''
+Local worker daemon that runs the encode, convert and delete jobs of exports
+outside MPlay, so the viewer is free again once the frames are saved
+
+MPlay saves the frames itself, then hands the rest of the queue over with
+Exporter.execute_detached. The daemon keeps what it was handed in the
+jobstore, so exports survive it being restarted, and runs each export through
+an Exporter whose ffmpeg jobs are separate processes. It leases the exports
+it holds in the jobstore, so MPlay's Resume Exports leaves them alone
+
+talks to its clients through local_service
+
+usage:
+    python export_worker.py serve
+    python export_worker.py encode /path/seq.$F4.jpg /path/out.mp4 --frames 1001 1100 --wait
+    python export_worker.py status 3
+    python export_worker.py shutdown
+'''
+
+import sys
+import time
+import queue
+import argparse
+import threading
+import logging
+
+import logic
+import dedupe
+import jobstore
+import local_service
+
+LOG = logging.getLogger(__name__)
+
+# jobs the daemon runs, saving frames needs MPlay
+REMOTE_JOBS = ("ffmpeg", "concat", "del", "dedupe", "copy")
+
+
+def default_address() -> str:
+    return local_service.default_address("worker")
+
+
+class ExportWorker(local_service.Service):
+    '''
+    The daemon, requests are dicts with an op:
+        ping
+        submit  settings, jobs (Job.to_dict), returns export_id
+        status  export_id, returns the state of every job and what deduplicating saved
+        shutdown
+    '''
+    def __init__(self, address=None, store=None, workers=None):
+        super().__init__(address or default_address())
+        self.store = store or jobstore.JobStore()
+        self.workers = workers
+        # lease owner in the store, the same across restarts so a new daemon takes over at once
+        self.owner = f"export_worker {self.address}"
+        self._exports = queue.Queue() # export ids to run
+        self._exporter = None # the one running, cancelled on shutdown
+        self._runner = None
+
+    def on_start(self):
+        '''Unfinished exports from last time run first'''
+        for export_id in self.store.unfinished(owner=self.owner):
+            if self.store.claim(export_id, self.owner):
+                self._exports.put(export_id)
+        self._runner = threading.Thread(target=self._run_exports, name="ExportWorker-runner", daemon=True)
+        self._runner.start()
+
+    def serve(self):
+        # the leases of the queued exports are renewed while they wait their turn
+        try:
+            with self.store.hold(self.owner):
+                super().serve()
+        finally:
+            self._exports.put(None)
+            if self._runner is not None:
+                self._runner.join()
+
+    def on_stop(self):
+        # a cancelled export is left unfinished in the store, it runs again on the next start
+        if self._exporter is not None:
+            self._exporter.cancel()
+
+    def handle(self, request: dict) -> dict:
+        op = request.get("op")
+        if op == "submit":
+            jobs = request["jobs"]
+            refused = sorted({job["type"] for job in jobs} - set(REMOTE_JOBS))
+            if refused:
+                return {"ok": False, "error": f"The worker does not run {', '.join(refused)} jobs"}
+            export_id = self.store.add_export(request.get("settings", {}), jobs, owner=self.owner)
+            self._exports.put(export_id)
+            return {"ok": True, "export_id": export_id}
+        if op == "status":
+            _, jobs = self.store.load_export(request["export_id"])
+            return {"ok": True, "jobs": [
+                {"type": job["type"], "output": job.get("outputpath") or job.get("inputpath"),
+                 "status": job["status"], "attempts": job["attempts"], "error": job["error"]}
+                for job in jobs
+            ], "savings": self.store.load_savings(request["export_id"])}
+        return super().handle(request)
+
+    def _run_exports(self):
+        while not self._stop.is_set():
+            export_id = self._exports.get()
+            if export_id is None:
+                return
+            try:
+                self._exporter = logic.Exporter.load(
+                    self.store, export_id, logic.Logic, workers=self.workers, owner=self.owner,
+                )
+                success = self._exporter.execute()
+                LOG.info(f"Export {export_id} {'finished' if success else 'failed'}")
+            except Exception:
+                LOG.exception(f"Export {export_id} could not run")
+            finally:
+                self._exporter = None
+
+
+class WorkerClient(local_service.ServiceClient):
+    '''Talks to the daemon, one connection per client'''
+    def __init__(self, address=None, timeout=5.0):
+        super().__init__(address or default_address(), timeout)
+
+    def submit(self, jobs: list, settings=None) -> int:
+        '''jobs are Job.to_dict dicts, depends_on indexes into jobs'''
+        return self.request("submit", jobs=jobs, settings=settings or {})["export_id"]
+
+    def status(self, export_id) -> list:
+        return self.request("status", export_id=export_id)["jobs"]
+
+    def savings(self, export_id) -> dedupe.Savings:
+        '''What deduplicating saved in the export so far'''
+        return dedupe.Savings(**self.request("status", export_id=export_id)["savings"])
+
+    def wait(self, export_id, timeout=None, interval=0.5) -> bool:
+        '''Waits for the export to stop running, returns True when every job is done'''
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            states = [job["status"] for job in self.status(export_id)]
+            if all(state == "done" for state in states):
+                return True
+            if "failed" in states and "running" not in states:
+                return False
+            if deadline is not None and time.monotonic() > deadline:
+                raise TimeoutError(f"Export {export_id} still running")
+            time.sleep(interval)
+
+
+def ensure_worker(address=None, timeout=local_service.START_TIMEOUT) -> WorkerClient:
+    '''Client of a running daemon, starts one when there is none, raises local_service.ServiceUnavailable'''
+    return local_service.ensure(WorkerClient(address), __file__, timeout=timeout)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--address", help="socket path or pipe name, defaults to one per user")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    serve = commands.add_parser("serve", help="run the daemon")
+    serve.add_argument("--workers", type=int, help="jobs of one export run at once")
+
+    commands.add_parser("ping", help="check the daemon answers")
+
+    encode_parser = commands.add_parser("encode", help="queue an ffmpeg encode of a sequence")
+    encode_parser.add_argument("inputpath", help="sequence with $F4 for the frame number")
+    encode_parser.add_argument("outputpath")
+    encode_parser.add_argument("--frames", type=int, nargs=2)
+    encode_parser.add_argument("--framerate", type=int, default=24)
+    encode_parser.add_argument("--codec", default=logic.encode.DEFAULT_PROFILE)
+    encode_parser.add_argument("--tier", default=logic.encode.DEFAULT_TIER)
+    encode_parser.add_argument("--chunks", type=int, help="parallel chunks of the encode")
+    encode_parser.add_argument("--wait", action="store_true", help="wait for the encode to finish")
+
+    status = commands.add_parser("status", help="job states of an export")
+    status.add_argument("export_id", type=int)
+
+    commands.add_parser("shutdown", help="stop the daemon once it answered")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+
+    if args.command == "serve":
+        ExportWorker(args.address, workers=args.workers).serve()
+        return 0
+
+    client = WorkerClient(args.address)
+    if args.command == "ping":
+        running = client.ping()
+        print("running" if running else "not running")
+        return 0 if running else 1
+    if args.command == "encode":
+        exporter = logic.Exporter({}, logic.Logic)
+        job = logic.Job(
+            inputpath=args.inputpath, outputpath=args.outputpath, frames=args.frames or [],
+            framerate=args.framerate, type="ffmpeg", codec=args.codec, tier=args.tier,
+        )
+        exporter.add_encode(job, chunks=args.chunks)
+        export_id = client.submit(exporter.serialize(), exporter.settings)
+        print(export_id)
+        if args.wait:
+            return 0 if client.wait(export_id) else 1
+        return 0
+    if args.command == "status":
+        for job in client.status(args.export_id):
+            print(f"{job['status']:8} {job['attempts']} {job['type']:7} {job['output']}")
+        savings = client.savings(args.export_id)
+        if savings:
+            print(f"Deduplicated: {savings}")
+        return 0
+    if args.command == "shutdown":
+        client.shutdown()
+        return 0
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
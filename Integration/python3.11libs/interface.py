@@ -4,6 +4,8 @@ from pprint import pprint, pformat
 import json
 import logging
 # from logic import Logic
+
+import encode
 """
 qt visual examples here
 https://www.tecgraf.puc-rio.br/ftp_pub/lfm/Qt-Widgets-Layouts.pdf
@@ -91,7 +93,13 @@ DEFAULT_SETTINGS = {
     "version": 1,
     "output_path": "",
     "resolution": "1920x1080",
-    "format": ".jpg"
+    "format": ".jpg",
+    "codec": encode.DEFAULT_PROFILE,
+    "tier": encode.DEFAULT_TIER,
+    "background": True, # encode in the export worker, MPlay is free once the frames are saved
+    "video": True,
+    "keep_images": True, # without them the frames are streamed into ffmpeg
+    "dedupe": False, # link versions identical to the previous one
 }
 
 # def load_settings():
@@ -310,23 +318,44 @@ class SaveDialog(QDialog):
         """Create the 'Export Video' settings group box."""
         group_video = QGroupBox("Export Video")
         group_video.setCheckable(True)
+        group_video.setChecked(self.settings.get("video", True))
+        self.video_group = group_video
         group_video_layout = QVBoxLayout()
         group_video.setLayout(group_video_layout)
 
         codec_layout = QHBoxLayout()
         codec_label = QLabel("Video Codec:")
         self.codec_combo = QComboBox()
-        self.codec_combo.addItem("AV1 (webm)", "av1")
-        self.codec_combo.addItem("H265 (mp4)", "h265")
-        self.codec_combo.setCurrentIndex(0)
+        for profile in encode.PROFILES.values():
+            self.codec_combo.addItem(profile.label, profile.name)
+        self.codec_combo.setCurrentIndex(max(self.codec_combo.findData(self.settings.get("codec", encode.DEFAULT_PROFILE)), 0))
         codec_layout.addWidget(codec_label)
         codec_layout.addWidget(self.codec_combo)
         group_video_layout.addLayout(codec_layout)
+
+        # speed against quality, preview for dailies, archive for finals
+        tier_layout = QHBoxLayout()
+        tier_label = QLabel("Quality:")
+        self.tier_combo = QComboBox()
+        for tier in encode.TIERS:
+            self.tier_combo.addItem(tier.capitalize(), tier)
+        self.tier_combo.setCurrentIndex(max(self.tier_combo.findData(self.settings.get("tier", encode.DEFAULT_TIER)), 0))
+        tier_layout.addWidget(tier_label)
+        tier_layout.addWidget(self.tier_combo)
+        group_video_layout.addLayout(tier_layout)
         
+        self.keep_images_checkbox = QCheckBox("Keep Images")
+        self.keep_images_checkbox.setChecked(self.settings.get("keep_images", True))
+        group_video_layout.addWidget(self.keep_images_checkbox)
+
         self.codec = self.codec_combo.currentData()
         self.codec_combo.currentIndexChanged.connect(
             lambda: setattr(self, "codec", self.codec_combo.currentData())
         )
+        self.tier = self.tier_combo.currentData()
+        self.tier_combo.currentIndexChanged.connect(
+            lambda: setattr(self, "tier", self.tier_combo.currentData())
+        )
 
         return group_video   
     
@@ -344,6 +373,14 @@ class SaveDialog(QDialog):
             "output_path": self.output_path_text.text(),
             "resolution": self.resolution_combo.currentText(),
             "image_format": self.format_combo.currentText(),
+            "codec": self.codec,
+            "tier": self.tier,
+            "video_format": encode.get_profile(self.codec).extension,
+            "background": self.settings.get("background", True),
+            "video": self.video_group.isChecked(),
+            "keep_images": self.keep_images_checkbox.isChecked() or not self.video_group.isChecked(),
+            "dedupe": self.settings.get("dedupe", False),
+            "context": self.context,
         }
         self.settings = new_settings
         self.accept()
@@ -369,6 +406,15 @@ class ProgressDialog(QDialog):
         self.job_label = QLabel(self)
         layout.addWidget(self.job_label)
 
+        # frames of the encode that last reported progress
+        self.frame_bar = QProgressBar(self)
+        self.frame_bar.setRange(0, 0)
+        self.frame_bar.setVisible(False)
+        layout.addWidget(self.frame_bar)
+
+        self.frame_label = QLabel(self)
+        layout.addWidget(self.frame_label)
+
         self.cancel_button = QPushButton("Cancel", self)
         layout.addWidget(self.cancel_button)
 
@@ -383,6 +429,7 @@ class ProgressDialog(QDialog):
 
     def on_cancel(self):
         self.canceled = True
+        self.exporter.cancel()
         self.reject()
 
     def on_ok(self):
@@ -396,14 +443,38 @@ class ProgressDialog(QDialog):
             self.cancel_button.setEnabled(False)
 
     def run_exporter(self):
-        for i, job in enumerate(self.exporter.queue):
-            if self.canceled:
-                break
-            job_description = f"Exporting {job.identifier}"
-            self.set_progress(i + 1, job_description)
-            self.exporter.execute()
+        finished = 0
+
+        def on_job(job):
+            # called on this thread as jobs start and end, keeps the dialog responsive
+            nonlocal finished
+            if job.status == "running":
+                self.job_label.setText(f"Exporting {job}")
+            else:
+                finished += 1
+                self.set_progress(finished, f"{job.status.capitalize()} {job}")
             QApplication.processEvents()
 
+        if self.exporter.settings.get("background"):
+            # encodes here when the worker can not start, the frames are saved by then
+            export_id = self.exporter.execute_detached(
+                on_job=on_job, on_poll=QApplication.processEvents, on_progress=self.set_frame_progress, fallback=True,
+            )
+            if export_id is not None:
+                self.set_progress(self.progress_bar.maximum(), f"Encoding in the background, export {export_id}")
+            return not any(job.status in ("failed", "skipped") for job in self.exporter.queue)
+
+        return self.exporter.execute(
+            on_job=on_job, on_progress=self.set_frame_progress, on_poll=QApplication.processEvents
+        )
+
+    def set_frame_progress(self, job, progress):
+        '''Shows the frames encoded so far, progress is an encode.Progress'''
+        self.frame_bar.setVisible(True)
+        self.frame_bar.setRange(0, progress.total_frames or 0) # busy bar when unknown
+        self.frame_bar.setValue(progress.frame)
+        self.frame_label.setText(str(progress))
+
 
 if __name__ == "__main__":
     '''Run our qt interface with basic prism'''
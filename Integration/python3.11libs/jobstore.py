@@ -0,0 +1,236 @@
+'''
+Keeps the exporter queue in sqlite so a crash does not lose pending work
+
+every export is a row with its settings, every job a row with the job
+serialized in full, its state and how often it was started. The exporter
+writes the state as jobs start and end, so after a crash the store says
+which steps finished and which to run again
+
+an export can be leased by the process running it, the export worker or an
+MPlay resuming it, so only one runs it. The lease lapses LEASE_TIME seconds
+after its owner last renewed it, an owner that died frees its exports then
+
+the file is local, ~/.cache/mplay/jobs.sqlite unless MPLAY_JOBSTORE is set
+'''
+
+import os
+import json
+import time
+import sqlite3
+import threading
+import contextlib
+import logging
+
+LOG = logging.getLogger(__name__)
+
+STATES = ("pending", "running", "done", "failed")
+
+# seconds an export stays leased to its owner without a renewal
+LEASE_TIME = 120.0
+
+_schema = """
+CREATE TABLE IF NOT EXISTS exports (
+    id INTEGER PRIMARY KEY,
+    created REAL NOT NULL,
+    settings TEXT NOT NULL,
+    owner TEXT,
+    lease REAL,
+    savings TEXT
+);
+CREATE TABLE IF NOT EXISTS jobs (
+    export_id INTEGER NOT NULL REFERENCES exports(id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    data TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    updated REAL NOT NULL,
+    PRIMARY KEY (export_id, position)
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs(status);
+"""
+# columns added since the first stores were made
+_added_columns = {"exports": [("owner", "TEXT"), ("lease", "REAL"), ("savings", "TEXT")]}
+
+
+def default_path() -> str:
+    return os.environ.get("MPLAY_JOBSTORE") or os.path.join(os.path.expanduser("~"), ".cache", "mplay", "jobs.sqlite")
+
+
+def process_owner() -> str:
+    '''Lease owner for exports run by this process'''
+    return f"pid {os.getpid()}"
+
+
+class JobStore:
+    '''
+    sqlite backed export queue
+    jobs are stored as dicts, logic.Job.to_dict / from_dict convert them
+    '''
+    def __init__(self, path=None):
+        self.path = path or default_path()
+        if self.path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        # the exporter runs on whichever thread calls execute
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._db:
+            # WAL commits survive the process dying, NORMAL is enough for that
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute("PRAGMA foreign_keys=ON")
+            self._db.executescript(_schema)
+            for table, columns in _added_columns.items():
+                existing = {row[1] for row in self._db.execute(f"PRAGMA table_info({table})")}
+                for name, kind in columns:
+                    if name not in existing:
+                        self._db.execute(f"ALTER TABLE {table} ADD COLUMN {name} {kind}")
+
+    def add_export(self, settings: dict, jobs: list, owner=None) -> int:
+        '''
+        Stores an export and its job dicts in one transaction, returns its id
+        owner leases it right away, so no one resumes it before it starts
+        '''
+        now = time.time()
+        with self._lock, self._db:
+            cursor = self._db.execute(
+                "INSERT INTO exports (created, settings, owner, lease) VALUES (?, ?, ?, ?)",
+                (now, _dumps(settings), owner, now + LEASE_TIME if owner else None),
+            )
+            export_id = cursor.lastrowid
+            self._db.executemany(
+                "INSERT INTO jobs (export_id, position, data, status, attempts, updated) VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (export_id, position, _dumps(job), job.get("status", "pending"), job.get("attempts", 0), now)
+                    for position, job in enumerate(jobs)
+                ],
+            )
+        return export_id
+
+    def update_job(self, export_id, position, status, attempts=None, error=None):
+        if status not in STATES:
+            raise ValueError(f"Unknown job state {status}, expected one of {', '.join(STATES)}")
+        with self._lock, self._db:
+            self._db.execute(
+                "UPDATE jobs SET status = ?, attempts = COALESCE(?, attempts), error = ?, updated = ? "
+                "WHERE export_id = ? AND position = ?",
+                (status, attempts, error, time.time(), export_id, position),
+            )
+
+    def load_export(self, export_id):
+        '''Returns (settings, [job dict with status and attempts]) in queue order'''
+        with self._lock:
+            row = self._db.execute("SELECT settings FROM exports WHERE id = ?", (export_id,)).fetchone()
+            if row is None:
+                raise KeyError(f"No export {export_id} in {self.path}")
+            rows = self._db.execute(
+                "SELECT data, status, attempts, error FROM jobs WHERE export_id = ? ORDER BY position",
+                (export_id,),
+            ).fetchall()
+        jobs = []
+        for data, status, attempts, error in rows:
+            job = json.loads(data)
+            job.update(status=status, attempts=attempts, error=error)
+            jobs.append(job)
+        return json.loads(row[0]), jobs
+
+    def add_savings(self, export_id, savings: dict):
+        '''Adds what deduplicating saved, vars of a dedupe.Savings, to the totals of the export'''
+        with self._lock, self._db:
+            row = self._db.execute("SELECT savings FROM exports WHERE id = ?", (export_id,)).fetchone()
+            totals = json.loads(row[0]) if row and row[0] else {}
+            for key, value in savings.items():
+                totals[key] = totals.get(key, 0) + value
+            self._db.execute("UPDATE exports SET savings = ? WHERE id = ?", (_dumps(totals), export_id))
+
+    def load_savings(self, export_id) -> dict:
+        '''Totals add_savings kept for the export, empty when nothing was deduplicated'''
+        with self._lock:
+            row = self._db.execute("SELECT savings FROM exports WHERE id = ?", (export_id,)).fetchone()
+        return json.loads(row[0]) if row and row[0] else {}
+
+    def unfinished(self, max_attempts=3, owner=None) -> list:
+        '''
+        Ids of the exports with jobs still to run, oldest first
+        exports someone other than owner holds a lease on are left out
+        '''
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT DISTINCT export_id FROM jobs "
+                "WHERE (status IN ('pending', 'running') OR (status = 'failed' AND attempts < ?)) "
+                # a job that failed max_attempts times ends the export, its chain can not finish
+                "AND export_id NOT IN (SELECT export_id FROM jobs WHERE status = 'failed' AND attempts >= ?) "
+                "AND export_id IN (SELECT id FROM exports WHERE owner IS NULL OR owner = ? OR lease < ?) "
+                "ORDER BY export_id",
+                (max_attempts, max_attempts, owner, time.time()),
+            ).fetchall()
+        return [export_id for export_id, in rows]
+
+    def claim(self, export_id, owner) -> bool:
+        '''Leases the export to owner, False when someone else holds a lease on it'''
+        now = time.time()
+        with self._lock, self._db:
+            cursor = self._db.execute(
+                "UPDATE exports SET owner = ?, lease = ? "
+                "WHERE id = ? AND (owner IS NULL OR owner = ? OR lease < ?)",
+                (owner, now + LEASE_TIME, export_id, owner, now),
+            )
+        return cursor.rowcount == 1
+
+    def renew(self, owner) -> int:
+        '''Extends the leases of owner, returns how many it holds'''
+        with self._lock, self._db:
+            cursor = self._db.execute(
+                "UPDATE exports SET lease = ? WHERE owner = ?", (time.time() + LEASE_TIME, owner)
+            )
+        return cursor.rowcount
+
+    def release(self, export_id, owner):
+        '''Ends the lease of owner on the export, once it finished or failed'''
+        with self._lock, self._db:
+            self._db.execute(
+                "UPDATE exports SET owner = NULL, lease = NULL WHERE id = ? AND owner = ?", (export_id, owner)
+            )
+
+    @contextlib.contextmanager
+    def hold(self, owner, interval=LEASE_TIME / 4):
+        '''Renews the leases of owner every interval seconds while in the with block'''
+        stop = threading.Event()
+
+        def renew():
+            while not stop.wait(interval):
+                try:
+                    self.renew(owner)
+                except sqlite3.Error as e:
+                    LOG.warning(f"Could not renew the leases of {owner}: {e}")
+
+        thread = threading.Thread(target=renew, name="JobStore-lease", daemon=True)
+        thread.start()
+        try:
+            yield self
+        finally:
+            stop.set()
+            thread.join()
+
+    def remove_export(self, export_id):
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM exports WHERE id = ?", (export_id,))
+
+    def prune(self, older_than=7 * 24 * 3600) -> int:
+        '''Removes finished exports older than older_than seconds, returns how many'''
+        cutoff = time.time() - older_than
+        with self._lock, self._db:
+            cursor = self._db.execute(
+                "DELETE FROM exports WHERE created < ? AND id NOT IN "
+                "(SELECT export_id FROM jobs WHERE status != 'done')",
+                (cutoff,),
+            )
+        return cursor.rowcount
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+def _dumps(value) -> str:
+    return json.dumps(value, default=str) # Path objects
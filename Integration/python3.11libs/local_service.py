@@ -0,0 +1,278 @@
+'''
+What the local daemons share, export_worker.py and prism_service.py
+
+a daemon listens with multiprocessing.connection on a unix socket, a named
+pipe on windows, one per user and daemon name. Clients prove they are the
+same user with an authkey file only that user can read. Requests and
+replies are dicts, a request has an op, a reply has ok and error when it failed
+
+daemons are started with a python interpreter, inside Houdini and MPlay
+sys.executable is the host binary, see find_python
+'''
+
+import os
+import sys
+import time
+import queue
+import shutil
+import secrets
+import threading
+import subprocess
+import logging
+from multiprocessing.connection import Listener, Client
+
+LOG = logging.getLogger(__name__)
+
+START_TIMEOUT = 5.0 # seconds a daemon gets to answer after it was started
+
+_unavailable = {} # address: why its daemon did not start, not tried again this session
+
+
+class ServiceUnavailable(RuntimeError):
+    '''The daemon does not run and could not be started'''
+
+
+def state_dir() -> str:
+    return os.environ.get("MPLAY_WORKER_DIR") or os.path.join(os.path.expanduser("~"), ".cache", "mplay")
+
+
+def default_address(name) -> str:
+    if sys.platform == "win32":
+        return rf"\\.\pipe\mplay_{name}_{os.environ.get('USERNAME', 'user')}"
+    return os.path.join(state_dir(), f"{name}.sock")
+
+
+def authkey() -> bytes:
+    '''The shared secret, created on first use and readable by the user only'''
+    path = os.path.join(state_dir(), "worker.key")
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    except FileNotFoundError:
+        os.makedirs(state_dir(), exist_ok=True)
+        key = secrets.token_bytes(32)
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, "wb") as f:
+            f.write(key)
+        return key
+
+
+class Service:
+    '''
+    Accepts connections until shutdown, each on its own thread
+    subclasses answer requests in handle, ping and shutdown are answered here
+
+    serial services answer every request one at a time on the thread that
+    called serve, for state that belongs to that thread, eg. PrismCore and its
+    Qt objects. That thread calls idle when no request is waiting
+    '''
+    serial = False
+
+    def __init__(self, address):
+        self.address = address
+        self._stop = threading.Event()
+        self._listener = None
+        self._requests = queue.Queue() # (request, reply slot) for serial services
+
+    def handle(self, request: dict) -> dict:
+        return {"ok": False, "error": f"Unknown op {request.get('op')}"}
+
+    def on_start(self):
+        '''Called once listening, before the first request'''
+
+    def on_stop(self):
+        '''Called on shutdown, from the thread that got the request'''
+
+    def idle(self):
+        '''Called by serial services between requests, keep it short or requests wait'''
+
+    def serve(self):
+        if not self.address.startswith("\\\\") and os.path.exists(self.address):
+            os.remove(self.address) # left by a daemon that died
+        self._listener = Listener(self.address, authkey=authkey())
+        self.on_start()
+        LOG.info(f"{type(self).__name__} listening on {self.address}")
+        if not self.serial:
+            self._accept()
+            return
+        acceptor = threading.Thread(target=self._accept, name=f"{type(self).__name__}-accept", daemon=True)
+        acceptor.start()
+        try:
+            while not self._stop.is_set():
+                try:
+                    request, slot = self._requests.get(timeout=0.1)
+                except queue.Empty:
+                    self.idle()
+                    continue
+                slot.append(self._answer(request))
+                slot.done.set()
+        finally:
+            self._stop.set()
+            acceptor.join()
+            while not self._requests.empty(): # nobody answers them anymore
+                request, slot = self._requests.get()
+                slot.append({"ok": False, "error": "Service stopped"})
+                slot.done.set()
+
+    def _accept(self):
+        try:
+            while not self._stop.is_set():
+                try:
+                    connection = self._listener.accept()
+                except Exception as e:
+                    LOG.warning(f"Rejected a connection: {e}")
+                    continue
+                if self._stop.is_set():
+                    connection.close()
+                    break
+                threading.Thread(target=self._handle, args=(connection,), daemon=True).start()
+        finally:
+            self._stop.set()
+            self._listener.close()
+
+    def _answer(self, request) -> dict:
+        try:
+            return self.handle(request)
+        except Exception as e:
+            LOG.exception(f"Request failed: {request.get('op')}")
+            return {"ok": False, "error": str(e)}
+
+    def _handle(self, connection):
+        with connection:
+            while True:
+                try:
+                    request = connection.recv()
+                except (EOFError, OSError):
+                    return
+                op = request.get("op")
+                if op == "ping":
+                    reply = {"ok": True, "pid": os.getpid()}
+                elif op == "shutdown":
+                    self._stop.set()
+                    self.on_stop()
+                    reply = {"ok": True}
+                elif self.serial:
+                    slot = _Slot()
+                    self._requests.put((request, slot))
+                    slot.done.wait()
+                    reply = slot[0]
+                else:
+                    reply = self._answer(request)
+                connection.send(reply)
+                if op == "shutdown":
+                    # closing the listener does not wake accept, a connection does
+                    Client(self.address, authkey=authkey()).close()
+                    return
+
+
+class _Slot(list):
+    '''Where the serving thread puts the reply of a serial request'''
+    def __init__(self):
+        super().__init__()
+        self.done = threading.Event()
+
+
+class ServiceClient:
+    '''Talks to a daemon over one connection, opened on the first request'''
+    def __init__(self, address, timeout=5.0):
+        self.address = address
+        self.timeout = timeout
+        self._connection = None
+
+    def request(self, op, **kwargs) -> dict:
+        if self._connection is None:
+            self._connection = Client(self.address, authkey=authkey())
+        self._connection.send({"op": op, **kwargs})
+        if not self._connection.poll(self.timeout):
+            self.close()
+            raise TimeoutError(f"{self.address} did not answer {op}")
+        reply = self._connection.recv()
+        if not reply.get("ok"):
+            raise RuntimeError(reply.get("error", f"{op} failed"))
+        return reply
+
+    def ping(self) -> bool:
+        try:
+            self.request("ping")
+            return True
+        except (OSError, EOFError, TimeoutError, RuntimeError):
+            self.close()
+            return False
+
+    def shutdown(self):
+        self.request("shutdown")
+        self.close()
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+
+def find_python() -> str:
+    '''
+    The python interpreter daemons are started with, None when there is none
+    MPLAY_WORKER_PYTHON when set, sys.executable when it is python, then the
+    python of the Houdini install, hython and the python on PATH
+    '''
+    configured = os.environ.get("MPLAY_WORKER_PYTHON")
+    if configured:
+        return configured
+    if os.path.basename(sys.executable).lower().startswith("python"):
+        return sys.executable
+    candidates = []
+    hfs = os.environ.get("HFS")
+    if hfs:
+        candidates += [
+            os.path.join(hfs, "python", "bin", "python3"),
+            os.path.join(hfs, f"python{sys.version_info.major}{sys.version_info.minor}", "python.exe"),
+            os.path.join(hfs, "bin", "hython.exe" if sys.platform == "win32" else "hython"),
+        ]
+    candidates += [shutil.which("python3"), shutil.which("python")]
+    for candidate in candidates:
+        if candidate and os.path.isfile(candidate) and os.access(candidate, os.X_OK):
+            return candidate
+    return None
+
+
+def ensure(client: ServiceClient, script, args=(), timeout=START_TIMEOUT) -> ServiceClient:
+    '''
+    client when its daemon answers, otherwise starts script serve first
+    raises ServiceUnavailable when it does not start, a daemon that failed to
+    start is not tried again this session so callers can fall back quickly
+    '''
+    if client.ping():
+        return client
+    if client.address in _unavailable:
+        raise ServiceUnavailable(_unavailable[client.address])
+
+    def unavailable(reason):
+        _unavailable[client.address] = reason
+        LOG.warning(reason)
+        return ServiceUnavailable(reason)
+
+    python = find_python()
+    if python is None:
+        raise unavailable(f"No python to start {os.path.basename(script)} with, set MPLAY_WORKER_PYTHON")
+    command = [python, os.path.abspath(script), "--address", client.address, "serve", *args]
+    flags = {}
+    if sys.platform == "win32":
+        flags["creationflags"] = subprocess.DETACHED_PROCESS | subprocess.CREATE_NEW_PROCESS_GROUP
+    else:
+        flags["start_new_session"] = True
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [os.path.dirname(__file__), os.environ.get("PYTHONPATH")])))
+    try:
+        process = subprocess.Popen(
+            command, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, env=env, **flags
+        )
+    except OSError as e:
+        raise unavailable(f"Could not start {os.path.basename(script)} with {python}: {e}")
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if client.ping():
+            return client
+        if process.poll() is not None:
+            raise unavailable(f"{os.path.basename(script)} exited with {process.returncode}, started with {python}")
+        time.sleep(0.1)
+    raise unavailable(f"{os.path.basename(script)} did not answer within {timeout:g}s, started with {python}")
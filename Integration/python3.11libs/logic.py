@@ -1,10 +1,24 @@
 import os
+import copy
+import contextlib
 import time
+import queue
+import shutil
+import tempfile
+import threading
 import subprocess
 from pathlib import Path
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 import logging
 from pprint import pprint
 
+import elPapi
+import encode
+import dedupe as dedupe_module # Exporter.dedupe is the switch
+import jobstore
+import templates
+
 LOG = logging.getLogger(__name__)
 LOG.setLevel(logging.DEBUG)
 
@@ -17,6 +31,19 @@ except ImportError as e:
 
 class Logic:
     # for use with Qt interface
+    use_version_index = True # latest versions from elPapi instead of prism queries
+    _projects = {} # project path: elPapi.Project
+    # resolved scenefile contexts, least recently used first, see context_from_path
+    context_cache_size = 256
+    _contexts = OrderedDict() # (project path, normalized path, mtime): context
+    _contexts_lock = threading.Lock()
+    use_compiled_templates = True # output paths without asking prism, see templates.py
+    _templates = {} # (project path, structure key): templates.Template
+    # scenefile keys we do not want in playblast contexts
+    _scenefile_keys = ["scenefile", "comment", "extension", "locations",
+                       "project_name", "version", "user", "username", "filename",
+                       "department", "task",
+                       ]
     def __init__(self):
         pass
    
@@ -74,21 +101,11 @@ class Logic:
             raise ValueError("Either filepath or context must be provided")
         
         if filepath:
-            file_context = pcore.getScenefileData(filepath)
-            # file_context = file_context.copy()
-            remove = ["scenefile", "comment", "extension", "locations",
-                  "project_name", "version", "user", "username", "filename",
-                  "department", "task",
-                  ]
-            for key in remove:
-                if key in file_context:
-                    del file_context[key]    
-            context = file_context
-            print("got context", context)
+            context = Logic.context_from_path(pcore, filepath)
+            LOG.debug(f"got context {context}")
         
         if context:                
             # get the entity_path template
-            structure = pcore.projects.getProjectStructure()
             if context.get("type") == "asset":
                 key = "assets"
                 # template = structure.get("assets")['value']
@@ -121,20 +138,50 @@ class Logic:
         
         
         maybe this modification should be another function that is explicit
+
+        contexts are cached by path and mtime, a saved scenefile is resolved again
+        returns a copy, callers may change it
         '''      
-        file_context = pcore.getScenefileData(filepath)
-        
-        # remove what we don't need, at least for playblasts
-        # maybe this needs to be different if we use this function for other things
-        remove = ["scenefile", "comment", "extension", "locations",
-                "project_name", "version", "user", "username", "filename",
-                "department", "task",
-                ]
-        for key in remove:
-            if key in file_context:
-                del file_context[key]            
-        
-        return file_context
+        return Logic.contexts_from_paths(pcore, [filepath])[filepath]
+
+    @staticmethod
+    def contexts_from_paths(pcore, filepaths) -> dict:
+        '''
+        {filepath: context} of many files, only the ones not cached are asked from prism
+        '''
+        project_path = getattr(pcore, "projectPath", None) # the same path resolves differently per project
+        keys = {filepath: (project_path, *_path_key(filepath)) for filepath in filepaths}
+        contexts = {}
+        with Logic._contexts_lock:
+            for filepath, key in keys.items():
+                if key in Logic._contexts:
+                    contexts[filepath] = Logic._contexts[key]
+        hits = [keys[filepath] for filepath in contexts]
+
+        for filepath, key in keys.items():
+            if filepath in contexts:
+                continue
+            file_context = dict(pcore.getScenefileData(filepath)) # prism may keep the dict it returns
+            # remove what we don't need, at least for playblasts
+            # maybe this needs to be different if we use this function for other things
+            for name in Logic._scenefile_keys:
+                file_context.pop(name, None)
+            contexts[filepath] = file_context
+            with Logic._contexts_lock:
+                Logic._contexts[key] = file_context
+        with Logic._contexts_lock:
+            for key in hits:
+                if key in Logic._contexts:
+                    Logic._contexts.move_to_end(key)
+            while len(Logic._contexts) > Logic.context_cache_size:
+                Logic._contexts.popitem(last=False)
+
+        return {filepath: copy.deepcopy(context) for filepath, context in contexts.items()}
+
+    @staticmethod
+    def clear_context_cache():
+        with Logic._contexts_lock:
+            Logic._contexts.clear()
         
 
     def get_prism_context(self, prismcore):
@@ -196,6 +243,36 @@ class Logic:
         pass
         
 
+    @staticmethod
+    def get_project(pcore, project_path=None):
+        '''
+        Cached elPapi project for a prism project
+        the version index is built on the first lookup and kept current afterwards
+        '''
+        project_path = os.path.normpath(project_path or pcore.projectPath)
+        project = Logic._projects.get(project_path)
+        if project is None:
+            project = elPapi.Project(project_path, pcore)
+            Logic._projects[project_path] = project
+        return project
+
+    @staticmethod
+    def latest_indexed_version(pcore, context: dict):
+        '''
+        Latest version from the elPapi version index
+        Returns None when the entity is not on disk, prism can still know about it
+        '''
+        project = Logic.get_project(pcore, context.get("project_path"))
+        if context.get("type") == "asset":
+            entity = project.get_asset(context["asset_path"].replace("\\", "/"))
+        elif context.get("type") == "shot":
+            entity = project.get_shot(f"{context['sequence']}/{context['shot']}")
+        else:
+            return None
+        if entity is None:
+            return None
+        return project.latest_version(entity, context["mediaType"], context["identifier"])
+
     @staticmethod
     def get_latest_playblast_version(pcore, context: dict, identifier: str="") -> int:
         '''
@@ -219,6 +296,14 @@ class Logic:
         assert 'identifier' in _temp_context, "Context missing identifier or not provided in function arguments"
 
         LOG.debug(f"Context provided to search for latest playblast: {_temp_context}")
+
+        if Logic.use_version_index:
+            try:
+                version = Logic.latest_indexed_version(pcore, _temp_context)
+                if version is not None:
+                    return version
+            except Exception as e:
+                LOG.warning(f"Version index lookup failed, asking prism instead: {e}")
         
         has_versions = len(pcore.mediaProducts.getVersionsFromContext(_temp_context))>0        
         version = 0
@@ -231,15 +316,35 @@ class Logic:
         return version               
         
     @staticmethod
-    def construct_outputpath(pcore, identifier, version, format, context):
+    def playblast_template(pcore, entity_type, project_path=None) -> templates.Template:
+        '''The compiled playblast files template of the project, compiled on first use'''
+        if entity_type == "asset":
+            key = "playblastFilesAssets"
+        elif entity_type == "shot":
+            key = "playblastFilesShots"
+        else:
+            raise ValueError(f"No playblast template for entity type {entity_type}")
+        cache_key = (os.path.normpath(project_path or pcore.projectPath), key)
+        template = Logic._templates.get(cache_key)
+        if template is None:
+            template = templates.compile_structure(pcore.projects.getTemplatePath, key, entity_type)
+            Logic._templates[cache_key] = template
+        return template
+
+    @staticmethod
+    def construct_outputpath(pcore, identifier, version, format, context, frame="$F4"):
         """        
         identifier is name of the flipbook
         version is the version number
+        frame fills the frame number of the template, None for a video
 
         location is equivalent to "Playblasts" structure
         @entity_path@/Playblasts/@identifier@ (remove the identifier part?)
         maybe location should just be @entity_path@
 
+        the path comes from the compiled template of the project, prism
+        resolves it when the template can not be compiled
+
         example:
         S:\job\R318\03_Production\Shots\SQ100\sh_030\Playblasts\Effects\v0019\SQ100-sh_030_Effects_v0019.1001.jpg
         E:\Projects\TOPHE\03_Production\Assets\Tophe\Playblasts\apex\v0005\apex_v0005.0001.exr
@@ -258,10 +363,15 @@ class Logic:
         assert isinstance(version, str), "Version must be a string"
         assert version.startswith("v"), "Version must start with 'v'"
 
-        identifier = identifier.replace(" ", "_")
-        context['identifier'] = identifier
-        context['version'] = version
-        context['extension'] = format
+        # the context of the caller stays as it is
+        context = {**context, "identifier": identifier.replace(" ", "_"), "version": version, "extension": format}
+
+        if Logic.use_compiled_templates:
+            try:
+                template = Logic.playblast_template(pcore, context["type"], context["project_path"])
+                return template.format(context, frame=frame)
+            except (KeyError, ValueError, AttributeError) as e:
+                LOG.debug(f"Compiled template failed, asking prism: {e!r}")
 
         if context.get("type") == "asset":
             key = "playblastFilesAssets"
@@ -273,12 +383,35 @@ class Logic:
         )   
         
         # replace @frame expression with houdini
-        playblast_path = playblast_path.replace("@.(frame)@", ".$F4")
+        playblast_path = playblast_path.replace("@.(frame)@", f".{frame}" if frame else "")
         
         output = Path(playblast_path).as_posix() # ensure forward slashes        
         # output = output.replace("$F4", "\$F4") # stop hscript from expanding
         return output
 
+    @staticmethod
+    def playblast_keys(pcore, filepath, entity_type=None) -> dict:
+        '''
+        The context keys of a playblast file, eg. identifier, version and frame
+        read by the compiled templates, prism is asked when they do not match
+        '''
+        entity_types = [entity_type] if entity_type else ["shot", "asset"]
+        if Logic.use_compiled_templates:
+            for kind in entity_types:
+                try:
+                    keys = Logic.playblast_template(pcore, kind).match(filepath)
+                except (ValueError, AttributeError) as e:
+                    LOG.debug(f"Compiled template failed, asking prism: {e!r}")
+                    break
+                if keys is not None:
+                    return {"type": kind, **keys}
+        for kind in entity_types:
+            key = "playblastFilesAssets" if kind == "asset" else "playblastFilesShots"
+            keys = pcore.projects.extractKeysFromPath(filepath, pcore.projects.getTemplatePath(key))
+            if keys:
+                return {"type": kind, **keys}
+        return {}
+
     @staticmethod
     def command_from_job(job):
         '''Construct a command from a job'''
@@ -300,105 +433,739 @@ class Logic:
             # video options            
             framerate = job.framerate
             #int(hou.text.expandString("$FPS"))
-            codec = "libaom-av1"
-            constant_rate_factor = 30
+            # encoder, quality and speed settings from the profile, see encode.PROFILES
+            codec_args = encode.get_profile(job.codec).args(job.tier)
 
             outputpath = job.outputpath            
-            # -crf sets the constant rate factor, lower is better quality, range is 0-63 for AV1
-            # -b:v 0 sets the bitrate to a variable rate, to achieve a constant quality
+            # encode only frames when given, eg. one chunk of a chunked encode
+            range_args = ""
+            if job.frames:
+                range_args = f"-start_number {job.frames[0]} "
+            output_args = f"-frames:v {job.frames[1] - job.frames[0] + 1} " if job.frames else ""
             # result string
+            # -progress pipe:1 writes key=value progress to stdout, -nostats keeps stderr quiet
             result = (
-                f'ffmpeg -framerate {framerate} -i "{inputpath}" '
-                f'-c:v {codec} -crf {constant_rate_factor} -b:v 0 "{outputpath}"'
-                f"-progress pipe:1"
+                f'ffmpeg -y -framerate {framerate} {range_args}-i "{inputpath}" {output_args}'
+                f'{codec_args} -progress pipe:1 -nostats "{outputpath}"'
             )
             return result
+        elif job.type == "stream":
+            # images of job.format are piped in as MPlay saves them, see Exporter._run_stream
+            codec_args = encode.get_profile(job.codec).args(job.tier)
+            return (
+                f'ffmpeg -y -f {encode.pipe_demuxer(job.format)} -framerate {job.framerate} -i pipe:0 '
+                f'{codec_args} -progress pipe:1 -nostats "{job.outputpath}"'
+            )
+        elif job.type == "concat":
+            # join the encoded chunks in inputpath without encoding again
+            # the container options of the profile, eg. the hvc1 tag, are lost in the mkv chunks
+            listpath = f"{job.outputpath}.concat.txt"
+            remux_args = encode.get_profile(job.codec).remux_args(job.tier or encode.DEFAULT_TIER) if job.codec else ""
+            return (
+                f'ffmpeg -y -f concat -safe 0 -i "{listpath}" -c copy {remux_args + " " if remux_args else ""}'
+                f'-progress pipe:1 -nostats "{job.outputpath}"'
+            )
+        elif job.type == "copy":
+            # the frames of a sequence on disk into a version, see Exporter._run_copy
+            return f'cp "{job.inputpath}" "{job.outputpath}"'
         elif job.type == "del":
-            if os.path.exists(job.inputpath):
-                if os.path.isdir(job.inputpath):
-                    subprocess.run(f"rm -r {job.inputpath}", shell=True)
-                else:
-                    os.remove(job.inputpath)
+            # removed by Exporter._run_del, every frame of a $F4 sequence
+            if "$F" in str(job.inputpath):
+                return f"rm {job.inputpath}"
             return f"rm -r {job.inputpath}"
 
 
 class Job:
-    '''Contains all the information necessary to create a filesequence or video'''
-    def __init__(self, inputpath="", outputpath="", frames=[], format="", framerate=24, type=""):        
+    '''
+    Contains all the information necessary to create a filesequence or video
+    depends_on are the jobs that must succeed before this one runs
+    '''
+    def __init__(self, inputpath="", outputpath="", frames=[], format="", framerate=24, type="", depends_on=None,
+                 codec=encode.DEFAULT_PROFILE, tier=encode.DEFAULT_TIER):        
         self.inputpath = inputpath
         self.outputpath = outputpath
         self.frames = frames
         self.format = format
         self.framerate = framerate
-        self.type = type # must be ffmpeg, hscript, del
+        self.type = type # must be ffmpeg, hscript, del, concat, stream, dedupe, copy
+        self.codec = codec # encode profile name, for ffmpeg
+        self.tier = tier # preview, review or archive
+        self.final_outputpath = "" # the video a chunk of a chunked encode ends up in
+        self.depends_on = list(depends_on or [])
+        self.status = "pending" # pending, running, done, failed, skipped
+        self.attempts = 0 # times it was started
+        self.result = None
+        self.position = None # index in the export kept in the jobstore
 
         # ensure format is valid, either video or image
         if type == "ffmpeg":
             pass 
             # check inputpath & outputpath is specified
+
+    # runtime state, not part of what the job does
+    _state = ("depends_on", "status", "attempts", "result", "position")
+
+    def to_dict(self, positions: dict) -> dict:
+        '''
+        Everything about the job as json types, for the jobstore
+        positions maps the jobs of the queue to their index, depends_on is stored by index
+        dependencies missing from positions are left out, Exporter.serialize checks they are done
+        '''
+        data = {key: value for key, value in vars(self).items() if key not in self._state}
+        data["depends_on"] = [positions[dep] for dep in self.depends_on if dep in positions]
+        return data
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        '''Job from to_dict, depends_on stays a list of indexes for the caller to resolve'''
+        job = cls()
+        for key, value in data.items():
+            if key not in ("status", "attempts", "error"):
+                setattr(job, key, value)
+        job.status = data.get("status", "pending")
+        job.attempts = data.get("attempts", 0)
+        return job
+
+    def __str__(self):
+        return f"{self.type} {self.outputpath or self.inputpath}"
         
 
 
 class Exporter:
     '''
     Handles exporting image sequences from MPlay
+
+    the queue is a graph, each job waits for the jobs in its depends_on.
+    hscript jobs talk to MPlay so they run on the calling thread, ffmpeg and
+    del jobs run on a pool of workers threads so independent chains overlap
     '''
-    def __init__(self, settings: dict, logic: Logic, dryrun=False):
+    def __init__(self, settings: dict, logic: Logic, dryrun=False, workers=None, poll_interval=0.1, resume=False, dedupe=False,
+                 store=None, max_attempts=3, pcore=None, owner=None):
         self.settings = settings
+        # prism core for the output paths of add_current_sequence, the context comes from the settings
+        self.pcore = pcore
+        # jobstore.JobStore that keeps the queue and job states across crashes
+        self.store = store
+        self.export_id = None
+        # holds the lease on the export in store while it runs, see jobstore.py
+        self.owner = owner or jobstore.process_owner()
+        self.max_attempts = max_attempts
         self.queue = []
         self.logic = logic
         self.dryrun = dryrun
-    
+        # only save the frames missing on disk and skip encodes newer than their frames
+        self.resume = resume
+        # link frames and video of a version identical to the previous one, see dedupe.py
+        self.dedupe = dedupe
+        self.savings = dedupe_module.Savings()
+        self._savings_lock = threading.Lock()
+        self._started = {} # job: time.monotonic() it started
+        self.workers = workers or min(4, os.cpu_count() or 1)
+        self.poll_interval = poll_interval # seconds between on_poll calls while jobs run
+        self._cancelled = threading.Event()
+        self._progress = queue.SimpleQueue() # (job, encode.Progress) from the workers
+        self._callbacks = (None, None)
+        self._holding = False # the lease on the export, execute_detached holds it across its steps
+
+    @classmethod
+    def load(cls, store, export_id, logic, **kwargs):
+        '''
+        Exporter for an export kept in store, finished jobs stay done
+        jobs that were running when it stopped run again, in resume mode so
+        only what they did not finish is redone
+        '''
+        settings, rows = store.load_export(export_id)
+        kwargs.setdefault("dedupe", settings.get("dedupe", False))
+        exporter = cls(settings, logic, store=store, resume=True, **kwargs)
+        exporter.export_id = export_id
+        exporter.queue = [Job.from_dict(row) for row in rows]
+        for position, job in enumerate(exporter.queue):
+            job.position = position
+            job.depends_on = [exporter.queue[position] for position in job.depends_on]
+            if job.status == "running":
+                job.status = "pending"
+        return exporter
+
+    @property
+    def unfinished(self) -> list:
+        return [job for job in self.queue if job.status != "done"]
 
-    def execute(self):
-        '''Run through the command queue'''
+    def add(self, job, depends_on=None):
+        '''Queues a job after the jobs it depends on, returns the job'''
+        job.depends_on.extend(depends_on or [])
+        self.queue.append(job)
+        return job
+
+    def add_encode(self, job, depends_on=None, chunks=None, min_chunk_frames=48):
+        '''
+        Queues an ffmpeg job, split into chunks encoded in parallel when it has
+        a frame range, the chunks are joined by a concat job
+        chunks defaults to the number of workers
+        returns the job that writes job.outputpath
+        '''
+        chunks = chunks or self.workers
+        ranges = encode.chunk_ranges(job.frames[0], job.frames[1], chunks, min_chunk_frames) if job.frames else []
+        if len(ranges) < 2:
+            return self.add(job, depends_on)
+
+        segments = []
+        for index, frames in enumerate(ranges):
+            segment = Job(
+                inputpath=job.inputpath, outputpath=encode.segment_path(job.outputpath, index),
+                frames=list(frames), format=job.format, framerate=job.framerate, type="ffmpeg",
+                codec=job.codec, tier=job.tier,
+            )
+            segment.final_outputpath = job.outputpath
+            segments.append(self.add(segment, depends_on))
+        concat = Job(
+            inputpath=[segment.outputpath for segment in segments], outputpath=job.outputpath,
+            frames=job.frames, format=job.format, framerate=job.framerate, type="concat",
+            codec=job.codec, tier=job.tier, # for the container options of the profile
+        )
+        return self.add(concat, depends_on=segments)
+
+    def cancel(self):
+        '''Stops starting jobs and terminates running encodes'''
+        self._cancelled.set()
+
+    def execute(self, on_job=None, on_progress=None, on_poll=None):
+        '''
+        Run through the command queue, returns True when every job succeeded
+        jobs after a failed one are skipped, other chains carry on
+
+        the callbacks are all called on the calling thread
+        on_job(job) when a job starts and ends
+        on_progress(job, encode.Progress) as ffmpeg encodes frames
+        on_poll() every poll_interval while waiting on the workers, eg. to process ui events
+        '''
+        self._check_graph()
+        if self.store is not None and self.export_id is not None and not self.store.claim(self.export_id, self.owner):
+            LOG.warning(f"Export {self.export_id} is leased to another process, not run")
+            return False
+        self._cancelled.clear()
+        self._callbacks = (on_progress, on_poll) # for main thread jobs that run a while
+        self.savings = dedupe_module.Savings()
+        self._started.clear()
         for job in self.queue:
-            command = self.logic.command_from_job(job)
-            result = None
-             
-            LOG.debug(f"Command created from job: \n{command}")
-            if self.dryrun:
-                print("Dryrun: ", command)
-            else:
-                if job.type == "hscript":                    
-                    result = hou.hscript(command)                
+            job.result = None
+            if self.store is not None and job.status == "done":
+                continue # finished before a crash or an earlier run
+            if self.store is not None and job.status == "failed" and job.attempts >= self.max_attempts:
+                continue # gave up on it
+            job.status = "pending"
+        if self.store is not None and self.export_id is None:
+            self._store_export()
+
+        running = {} # future: job
+        with self._leased(), ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="Exporter") as pool:
+            while True:
+                self._skip_blocked()
+                ready = [] if self._cancelled.is_set() else [job for job in self.queue if self._is_ready(job)]
+                for job in ready:
+                    if job.type not in MAIN_THREAD_JOBS:
+                        self._start(job, on_job)
+                        running[pool.submit(self._run_job, job)] = job
+
+                main_thread_jobs = [job for job in ready if job.type in MAIN_THREAD_JOBS]
+                if main_thread_jobs:
+                    # one at a time, the workers may have finished jobs meanwhile
+                    job = main_thread_jobs[0]
+                    self._start(job, on_job)
+                    self._finish(job, self._call(self._run_job, job), on_job)
+                    done = [future for future in running if future.done()]
+                elif running:
+                    done, _ = wait(running, timeout=self.poll_interval, return_when=FIRST_COMPLETED)
+                    if on_poll:
+                        on_poll()
                 else:
-                    result = subprocess.run(command, shell=True)    # ffmpeg
-                
-            if not result:# if result unsuccessful
-                LOG.error(f"Failed to execute command: {command}")
-                return result
-            
+                    break
 
-    def add_current_sequence(self, convert_video=False, keep_images=True):
-        """Save the currently selected sequence to disk."""
-        # When doing "Current", there is no way to query MPlay for seq name
-        # we need a location to save the file, this should be from settings       
-        #  
-        output_sequence = self.logic.construct_outputpath(
-            self.settings.get("identifier"),
-            self.settings.get("version"),
-            self.settings.get("image_format"),
+                self._report_progress(on_progress)
+                for future in done:
+                    self._finish(running.pop(future), self._call(future.result), on_job)
+
+        for job in self.queue:
+            if job.status == "pending":
+                job.status = "skipped"
+        if self.savings:
+            LOG.info(f"Deduplicated: {self.savings}")
+            if self.store is not None:
+                # the export worker logs to nowhere, MPlay reads them from the store
+                self.store.add_savings(self.export_id, vars(self.savings))
+        return all(job.status == "done" for job in self.queue)
+
+    def _store_export(self):
+        '''Adds the whole queue to the store, the jobs keep their position in it'''
+        self.export_id = self.store.add_export(self.settings, self.serialize(), owner=self.owner)
+        for position, job in enumerate(self.queue):
+            job.position = position
+
+    def serialize(self, jobs=None) -> list:
+        '''
+        Job dicts of jobs, the whole queue by default, for the jobstore and the export worker
+        jobs may depend on jobs left out only when those are done
+        '''
+        jobs = self.queue if jobs is None else jobs
+        positions = {job: position for position, job in enumerate(jobs)}
+        for job in jobs:
+            for dep in job.depends_on:
+                if dep not in positions and dep.status != "done":
+                    raise ValueError(f"{job} depends on {dep}, which is neither serialized nor done")
+        return [job.to_dict(positions) for job in jobs]
+
+    def execute_detached(self, client=None, on_job=None, on_poll=None, on_progress=None, fallback=False):
+        '''
+        Runs the jobs that need MPlay, then hands the rest of the queue to the
+        export worker and returns without waiting for it, see export_worker.py
+        client is an export_worker.WorkerClient, a worker is started when there is none
+        fallback runs the rest here when the worker can not be reached, otherwise that raises
+
+        returns the export id in the worker, None when nothing was handed over
+        because a job here failed, every job already ran or it ran here
+        '''
+        import export_worker # imports logic
+        import local_service
+
+        self._check_graph()
+        local = [job for job in self.queue if job.type in MAIN_THREAD_JOBS]
+        remote = [job for job in self.queue if job.type not in MAIN_THREAD_JOBS]
+        for job in local:
+            if any(dep.type not in MAIN_THREAD_JOBS for dep in job.depends_on):
+                raise ValueError(f"{job} needs MPlay but waits on a job for the export worker")
+
+        # the whole queue is stored, the steps below run parts of it
+        if self.store is not None and self.export_id is None:
+            self._store_export()
+        with self._leased():
+            queued, self.queue = self.queue, local
+            try:
+                self.execute(on_job=on_job, on_poll=on_poll)
+            finally:
+                self.queue = queued
+            self._skip_blocked()
+            remote = [job for job in remote if job.status == "pending"]
+            if not remote:
+                return None
+
+            try:
+                client = client or export_worker.ensure_worker()
+                export_id = client.submit(self.serialize(remote), self.settings)
+            except (local_service.ServiceUnavailable, OSError, EOFError) as e:
+                if not fallback:
+                    raise
+                LOG.warning(f"Export worker not available, running {len(remote)} jobs here: {e}")
+                queued, self.queue = self.queue, remote
+                try:
+                    self.execute(on_job=on_job, on_progress=on_progress, on_poll=on_poll)
+                finally:
+                    self.queue = queued
+                return None
+        if self.store is not None:
+            # the worker keeps the rest as its own export, resuming this one would run it twice
+            self.store.remove_export(self.export_id)
+        LOG.info(f"Handed {len(remote)} jobs to the export worker as export {export_id}")
+        return export_id
+
+    def _run_job(self, job):
+        if self.resume or self.dedupe:
+            skipped = self._resume_job(job)
+            if skipped is not None:
+                return skipped
+        if job.type == "dedupe":
+            return self._run_dedupe(job)
+        command = self.logic.command_from_job(job)
+        LOG.debug(f"Command created from job: \n{command}")
+        if self.dryrun:
+            print("Dryrun: ", command)
+            return True
+        if job.type == "hscript":
+            return hou.hscript(command)
+        if job.type in ("ffmpeg", "stream", "concat"):
+            # a video can be the first file of its version
+            os.makedirs(os.path.dirname(str(job.outputpath)) or ".", exist_ok=True)
+        if job.type == "del":
+            return self._run_del(job)
+        if job.type == "concat":
+            return self._run_concat(job, command)
+        if job.type == "copy":
+            return self._run_copy(job)
+        if job.type == "stream":
+            return self._run_stream(job, command)
+        if job.type == "ffmpeg":
+            total_frames = job.frames[1] - job.frames[0] + 1 if job.frames else encode.count_frames(job.inputpath)
+            result = encode.run_ffmpeg(
+                command, on_progress=lambda progress: self._progress.put((job, progress)),
+                total_frames=total_frames, cancel=self._cancelled,
+            )
+            if result.returncode:
+                LOG.error(f"ffmpeg failed: {result.stderr[-2000:]}")
+            return result
+        return subprocess.run(command, shell=True)
+
+    def _resume_job(self, job):
+        '''
+        Runs what is left of an interrupted job, returns None to run it whole
+        hscript jobs save only the missing or empty frames, encodes newer than
+        every frame they read are skipped
+        '''
+        if job.type == "hscript" and job.frames and self.resume:
+            ranges = encode.missing_ranges(encode.sequence_frames(job.outputpath), *job.frames)
+            LOG.info(f"Resuming {job}, frames to save: {ranges or 'none'}")
+            output, errors = "", ""
+            for frames in ranges:
+                part = Job(outputpath=job.outputpath, frames=list(frames), type="hscript")
+                command = self.logic.command_from_job(part)
+                if self.dryrun:
+                    print("Dryrun: ", command)
+                    continue
+                part_output, part_errors = hou.hscript(command)
+                output += part_output
+                errors += part_errors
+            return True if self.dryrun else (output, errors)
+
+        if job.type == "ffmpeg":
+            video = job.final_outputpath or job.outputpath
+            if encode.is_up_to_date(video, job.inputpath, job.frames if not job.final_outputpath else None):
+                LOG.info(f"Skipping {job}, {video} is newer than its frames")
+                return True
+        if job.type == "concat" and all(not os.path.exists(segment) for segment in job.inputpath):
+            if os.path.exists(job.outputpath):
+                LOG.info(f"Skipping {job}, the chunks were skipped")
+                return True
+        return None
+
+    def _run_dedupe(self, job):
+        '''Links the version to the previous one when the frames are identical'''
+        if self.dryrun:
+            print("Dryrun: dedupe", job.inputpath)
+            return True
+        savings = dedupe_module.link_previous_version(job.inputpath, job.outputpath)
+        if savings:
+            with self._savings_lock:
+                self.savings.add(savings)
+        return True
+
+    def _run_copy(self, job):
+        '''
+        Copies the frames of the inputpath sequence in job.frames to the outputpath sequence
+        in resume mode frames already copied, same size and not older, are kept
+        '''
+        frames = encode.sequence_frames(job.inputpath)
+        if job.frames:
+            frames = {frame: stat for frame, stat in frames.items() if job.frames[0] <= frame <= job.frames[1]}
+        if not frames:
+            LOG.error(f"No frames to copy in {job.inputpath}")
+            return False
+        os.makedirs(os.path.dirname(str(job.outputpath)), exist_ok=True)
+        copied = encode.sequence_frames(job.outputpath) if self.resume else {}
+        for frame, stat in frames.items():
+            if self._cancelled.is_set():
+                return False
+            existing = copied.get(frame)
+            if existing and existing.st_size == stat.st_size and existing.st_mtime >= stat.st_mtime:
+                continue
+            shutil.copy2(encode.frame_path(job.inputpath, frame), encode.frame_path(job.outputpath, frame))
+        return True
+
+    def _run_del(self, job):
+        '''Removes every frame of a $F4 sequence, or the file or folder of inputpath'''
+        path = str(job.inputpath)
+        if "$F" in path:
+            for frame in encode.sequence_frames(path):
+                os.remove(encode.frame_path(path, frame))
+            return not encode.sequence_frames(path)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        elif os.path.exists(path):
+            os.remove(path)
+        return not os.path.exists(path)
+
+    def _run_stream(self, job, command):
+        '''
+        Saves one frame at a time from MPlay and pipes it into ffmpeg
+        each frame goes through a scratch file on the local temp disk and is
+        removed as soon as it is read, nothing is written next to the video
+        '''
+        on_progress, on_poll = self._callbacks
+        first, last = job.frames
+        stream = encode.FrameStream(
+            command, on_progress=lambda progress: self._progress.put((job, progress)),
+            total_frames=last - first + 1,
         )
+        scratch_dir = tempfile.mkdtemp(prefix="mplay_stream_")
+        scratch = os.path.join(scratch_dir, f"frame{job.format}").replace("\\", "/")
+        try:
+            for frame in range(first, last + 1):
+                if self._cancelled.is_set():
+                    return stream.terminate()
+                _, errors = hou.hscript(f"imgsave -f {frame} {frame} {scratch}")
+                if errors:
+                    LOG.error(f"imgsave failed on frame {frame}: {errors}")
+                    stream.terminate()
+                    return False
+                with open(scratch, "rb") as f:
+                    stream.feed(f.read())
+                os.remove(scratch)
+                self._report_progress(on_progress)
+                if on_poll:
+                    on_poll()
+            result = stream.close()
+        except Exception:
+            stream.terminate()
+            raise
+        finally:
+            shutil.rmtree(scratch_dir, ignore_errors=True)
+        if result.returncode:
+            LOG.error(f"ffmpeg failed: {result.stderr[-2000:]}")
+        return result
+
+    def _run_concat(self, job, command):
+        '''Joins the chunks, they are removed once the video is written'''
+        listpath = f"{job.outputpath}.concat.txt"
+        encode.write_concat_list(job.inputpath, listpath)
+        try:
+            result = subprocess.run(command, shell=True, capture_output=True, text=True)
+        finally:
+            os.remove(listpath)
+        if result.returncode:
+            LOG.error(f"ffmpeg concat failed: {result.stderr[-2000:]}")
+        else:
+            for segment in job.inputpath:
+                os.remove(segment)
+        return result
 
-        write_seq_job = Job(outputpath=output_sequence, type="hscript")         
-        self.queue.append(write_seq_job)   
+    def _report_progress(self, on_progress):
+        '''Hands the progress the workers queued to on_progress, only the latest per job'''
+        latest = {}
+        while True:
+            try:
+                job, progress = self._progress.get_nowait()
+            except queue.Empty:
+                break
+            latest[job] = progress
+        if on_progress:
+            for job, progress in latest.items():
+                on_progress(job, progress)
 
+    @staticmethod
+    def _call(func, *args):
+        try:
+            return func(*args)
+        except Exception as e:
+            LOG.exception(f"Job raised: {e}")
+            return e
+
+    def _start(self, job, on_job):
+        job.status = "running"
+        job.attempts += 1
+        self._started[job] = time.monotonic()
+        self._store_state(job)
+        if on_job:
+            on_job(job)
+
+    def _finish(self, job, result, on_job):
+        job.result = result
+        job.status = "done" if _succeeded(result) else "failed"
+        self._store_state(job, error=None if job.status == "done" else str(result)[-2000:])
+        if job.status == "failed":
+            LOG.error(f"Failed to execute job: {job}")
+        elif self.dedupe and job.type in ("ffmpeg", "concat") and not job.final_outputpath and result is not True:
+            # result True is a skipped encode, a real one is timed from its first chunk
+            encodes = [job] + [dep for dep in job.depends_on if dep.type == "ffmpeg"]
+            started = min(self._started[encode_job] for encode_job in encodes if encode_job in self._started)
+            dedupe_module.record_encode(job.outputpath, time.monotonic() - started)
+        if on_job:
+            on_job(job)
+
+    @contextlib.contextmanager
+    def _leased(self):
+        '''Keeps the lease on the export while it runs and ends it after'''
+        if self.store is None or self._holding:
+            yield
+            return
+        self._holding = True
+        with self.store.hold(self.owner):
+            try:
+                yield
+            finally:
+                self._holding = False
+                self.store.release(self.export_id, self.owner)
+
+    def _store_state(self, job, error=None):
+        if self.store is None or self.export_id is None or job.position is None:
+            return
+        try:
+            self.store.update_job(self.export_id, job.position, job.status, job.attempts, error)
+        except Exception as e:
+            LOG.warning(f"Could not store the state of {job}: {e}")
+
+    def _is_ready(self, job) -> bool:
+        return job.status == "pending" and all(dep.status == "done" for dep in job.depends_on)
+
+    def _skip_blocked(self):
+        '''Marks jobs that wait on a failed or skipped job as skipped'''
+        changed = True
+        while changed:
+            changed = False
+            for job in self.queue:
+                if job.status == "pending" and any(dep.status in ("failed", "skipped") for dep in job.depends_on):
+                    job.status = "skipped"
+                    changed = True
+
+    def _check_graph(self):
+        '''
+        Raises ValueError when a dependency is not queued or the jobs wait on each other
+        dependencies that are done may be left out, eg. the MPlay jobs of execute_detached
+        '''
+        queued = set(map(id, self.queue))
+        for job in self.queue:
+            for dep in job.depends_on:
+                if id(dep) not in queued and dep.status != "done":
+                    raise ValueError(f"{job} depends on a job that is not queued: {dep}")
+
+        state = {} # id: 1 visiting, 2 visited
+        for start in self.queue:
+            if id(start) in state:
+                continue
+            state[id(start)] = 1
+            stack = [(start, iter(start.depends_on))]
+            while stack:
+                job, deps = stack[-1]
+                dep = next(deps, None)
+                if dep is None:
+                    state[id(job)] = 2
+                    stack.pop()
+                elif state.get(id(dep)) == 1:
+                    raise ValueError(f"Jobs depend on each other: {job} and {dep}")
+                elif id(dep) not in state:
+                    state[id(dep)] = 1
+                    stack.append((dep, iter(dep.depends_on)))
+            
+
+    def add_current_sequence(self, convert_video=False, keep_images=True, chunks=None):
+        """
+        Save the currently selected sequence to disk.
+        the video is encoded in chunks when the settings hold a frame range
+        without keep_images the frames are streamed into ffmpeg instead,
+        no image sequence is written
+        """
+        # When doing "Current", there is no way to query MPlay for seq name
+        # the playblast version of the context in the settings is where it goes
+        context = self.settings.get("context")
+        if not context:
+            raise ValueError("The settings have no context to save the sequence in")
+        identifier = self.settings.get("identifier")
+        version = self.settings.get("version")
+        image_format = _extension(self.settings.get("image_format") or ".jpg")
+        frames = _frame_range(self.settings)
         if convert_video:
+            profile = encode.get_profile(self.settings.get("codec"))
             output_video = self.logic.construct_outputpath(
-                self.settings.get("identifier"),
-                self.settings.get("version"),
-                self.settings.get("video_format"),
+                self.pcore, identifier, version, _extension(self.settings.get("video_format") or profile.extension),
+                context, frame=None,
             )   
-            job_video = Job(inputpath=output_sequence, outputpath=output_video, type="ffmpeg")            
-            self.queue.append(job_video)     
+            tier = self.settings.get("tier", encode.DEFAULT_TIER)
+
+            if not keep_images:
+                if frames:
+                    stream_job = Job(
+                        outputpath=output_video, frames=frames, format=image_format,
+                        type="stream", codec=profile.name, tier=tier,
+                    )
+                    return self.add(stream_job)
+                LOG.warning("No frame range to stream, writing the images and removing them after")
+
+        output_sequence = self.logic.construct_outputpath(self.pcore, identifier, version, image_format, context)
+
+        # with the range known a resumed export saves only the frames missing on disk, else all of them
+        write_seq_job = Job(outputpath=output_sequence, frames=frames, type="hscript")
+        self.add(write_seq_job)   
+
+        if convert_video:
+            before_encode = write_seq_job
+            if self.dedupe:
+                # links the video too when the frames match the previous version, the encode is then skipped
+                before_encode = self.add(
+                    Job(inputpath=output_sequence, outputpath=output_video, type="dedupe"), depends_on=[write_seq_job]
+                )
+            job_video = Job(
+                inputpath=output_sequence, outputpath=output_video, frames=frames, type="ffmpeg",
+                codec=profile.name, tier=tier,
+            )            
+            job_video = self.add_encode(job_video, depends_on=[before_encode], chunks=chunks)     
 
             if not keep_images:
                 del_images_job = Job(inputpath=output_sequence, type="del")
-                self.queue.append(del_images_job)
+                self.add(del_images_job, depends_on=[job_video])
+        elif self.dedupe:
+            self.add(Job(inputpath=output_sequence, type="dedupe"), depends_on=[write_seq_job])
               
     
 
+def _path_key(filepath) -> tuple:
+    '''(normalized path, mtime) of a file, mtime is None when it does not exist yet'''
+    path = os.path.normcase(os.path.abspath(str(filepath)))
+    try:
+        return path, os.stat(path).st_mtime_ns
+    except OSError:
+        return path, None
+
+def _extension(format) -> str:
+    '''.jpg for jpg or .jpg'''
+    return format if format.startswith(".") else f".{format}"
+
+def _frame_range(settings) -> list:
+    '''
+    [start, end] from the settings, variables like $FSTART are expanded when hou is there
+    empty when they are not frame numbers
+    '''
+    try:
+        return [int(_expand(settings["frame_range_start"])), int(_expand(settings["frame_range_end"]))]
+    except (KeyError, TypeError, ValueError):
+        return []
+
+def _expand(value):
+    if isinstance(value, str) and "$" in value and "hou" in globals():
+        return hou.text.expandString(value)
+    return value
+
+def resume_exports(logic, store=None, allow_mplay=False, on_job=None) -> dict:
+    '''
+    Runs the unfinished exports kept in the jobstore, returns {export id: success}
+    saving frames needs the same sequence loaded in MPlay, so exports still
+    waiting on that are left alone unless allow_mplay. Exports the export
+    worker or another MPlay holds a lease on are theirs to run
+    '''
+    store = store or jobstore.JobStore()
+    owner = jobstore.process_owner()
+    results = {}
+    for export_id in store.unfinished():
+        if not store.claim(export_id, owner):
+            continue # leased since it was listed
+        exporter = Exporter.load(store, export_id, logic, owner=owner)
+        waiting_on_mplay = [job for job in exporter.unfinished if job.type in MAIN_THREAD_JOBS]
+        if waiting_on_mplay and not allow_mplay:
+            LOG.info(f"Export {export_id} needs MPlay for {waiting_on_mplay[0]}, not resumed")
+            store.release(export_id, owner)
+            continue
+        LOG.info(f"Resuming export {export_id}, {len(exporter.unfinished)} of {len(exporter.queue)} jobs left")
+        results[export_id] = exporter.execute(on_job=on_job)
+    return results
+
+# job types that talk to MPlay, they run on the thread calling execute
+MAIN_THREAD_JOBS = ("hscript", "stream")
+
+def _succeeded(result) -> bool:
+    '''Whether the result of a job is a success'''
+    if isinstance(result, Exception):
+        return False
+    if isinstance(result, subprocess.CompletedProcess):
+        return result.returncode == 0
+    if isinstance(result, tuple): # hou.hscript returns (output, errors)
+        return not result[1]
+    return bool(result)
+
+
 if __name__ == "__main__":
     settings = {
         "location": "$HIP/flip/",
@@ -8,6 +8,7 @@ import os
 import logging
 import time
 import logic
+import jobstore
 from pprint import pprint, pformat
 
 LOG = logging.getLogger(__name__)
@@ -39,11 +40,35 @@ def setup_imports() -> None:
     LOG.info(pformat(sys.path))
 
 
+def connect_prism():
+    '''
+    Reads paths and versions of the project of the hip file straight from its
+    config, PrismCore only starts when something needs it, see prism_resolver.py
+    '''
+    import hou
+    import prism_resolver
+    return prism_resolver.connect(hou.hipFile.path())
+
+def connect() -> tuple:
+    '''
+    (pcore, Logic) for the menu actions. The prism service answers in
+    milliseconds once it runs, see prism_service.py, it is started on the
+    first click. MPLAY_PRISM_SERVICE=0 resolves prism in Houdini instead,
+    =standin runs the service without PrismCore
+    '''
+    if os.environ.get("MPLAY_PRISM_SERVICE", "1") != "0":
+        try:
+            import prism_service
+            prism_service.ServiceLogic._client()
+            return None, prism_service.ServiceLogic
+        except Exception as e:
+            LOG.warning(f"Prism service not available, resolving in Houdini: {e}")
+    return connect_prism(), logic.Logic
+
 def quicksave(kwargs=None) -> None:
     # connect to Prism
     setup_imports() # setting up imports is faster than relying on PrismInit
-    import PrismInit    
-    pcore = PrismInit.prismInit()
+    pcore, Logic = connect()
 
     # load settings
     import interface
@@ -57,19 +82,43 @@ def quicksave(kwargs=None) -> None:
 def save(kwargs=None):
     # connect to Prism
     setup_imports() # setting up imports is faster than relying on PrismInit
-    import PrismInit    
-    pcore = PrismInit.prismInit()
+    pcore, Logic = connect()
 
     # load settings
+    import hou
     import interface
     settings = interface.DEFAULT_SETTINGS
     # settings = json.loads(settings)    
     # show dialog
-    dialog = interface.SaveDialog(settings, pcore) 
-    dialog.exec_() # modifies settings
+    dialog = interface.SaveDialog(settings, pcore, Logic, hou) 
+    if not dialog.exec_(): # modifies settings
+        return None
+    settings = dialog.get_settings()
     # save settings
     # run exporter
-    pass
+    # kept in the jobstore, so Resume Exports can finish it after a crash
+    exporter = logic.Exporter(
+        settings, Logic, dedupe=settings.get("dedupe", False), store=jobstore.JobStore(), pcore=pcore,
+    )
+    exporter.add_current_sequence(convert_video=settings["video"], keep_images=settings["keep_images"])
+    progress_dialog = interface.ProgressDialog(exporter)
+    progress_dialog.show()
+    success = progress_dialog.run_exporter()
+    message = "All jobs completed" if success else "Export failed, see the console"
+    if exporter.savings: # the jobs run here, export_worker.py status shows those of the worker
+        message += f", {exporter.savings}"
+    progress_dialog.set_progress(progress_dialog.progress_bar.maximum(), message)
+    progress_dialog.exec_() # until Ok
+    return success
+
+def resume(kwargs=None):
+    '''Finishes exports a crash or a closed MPlay left unfinished'''
+    results = logic.resume_exports(logic.Logic, allow_mplay=False)
+    for export_id, success in results.items():
+        LOG.info(f"Export {export_id} {'finished' if success else 'failed again'}")
+    if not results:
+        LOG.info("No exports to resume")
+    return results
 
 def debug(kwargs=None):      
     LOG.setLevel(logging.DEBUG)
@@ -77,8 +126,7 @@ def debug(kwargs=None):
     start_time = time.time()
     
     setup_imports() # setting up imports is faster than relying on PrismInit
-    import PrismInit    
-    pcore = PrismInit.prismInit()    
+    pcore, Logic = connect()
 
     end_time = time.time()
     LOG.debug(f"End of debug, duration: {end_time - start_time:.3f} seconds")
@@ -91,7 +139,7 @@ def debug(kwargs=None):
     settings = interface.DEFAULT_SETTINGS
 
     brain = logic.Logic()
-    dialog = interface.SaveDialog(settings, pcore, logic.Logic, hou)
+    dialog = interface.SaveDialog(settings, pcore, Logic, hou)
     result = dialog.exec_()
 
     if result:
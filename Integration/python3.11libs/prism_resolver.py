@@ -0,0 +1,252 @@
+'''
+Answers the path questions we ask prism without starting PrismCore
+
+reads the folder structure templates from the pipeline config of the project,
+00_Pipeline/pipeline.json, and answers context from path, entity paths and
+latest versions from them and the disk. It has the names of the PrismCore
+methods logic.py calls, so it can be passed wherever a pcore is expected.
+Anything else, eg. writing versioninfo or changing the project config,
+starts the real PrismCore and is handed to it
+
+usage:
+    pcore = prism_resolver.connect(hou.hipFile.path())
+    Logic.context_from_path(pcore, hou.hipFile.path())
+'''
+
+import os
+import re
+import json
+import logging
+
+import templates
+
+LOG = logging.getLogger(__name__)
+
+PIPELINE_FOLDER = "00_Pipeline"
+CONFIG_NAMES = ("pipeline.json", "pipeline.yml")
+
+_version_folder = re.compile(r"^v(\d+)")
+
+# the prism defaults, used for the keys a project config does not set
+DEFAULT_STRUCTURE = {
+    "assets": "@project_path@/03_Production/Assets/@asset_path@",
+    "shots": "@project_path@/03_Production/Shots/@sequence@/@shot@",
+    "departments": "@entity_path@/Scenefiles/@department@",
+    "tasks": "@department_path@/@task@",
+    "assetScenefiles": "@task_path@/@task@_@version@@extension@",
+    "shotScenefiles": "@task_path@/@sequence@-@shot@_@task@_@version@@extension@",
+    "playblasts": "@entity_path@/Playblasts/@identifier@",
+    "playblastVersions": "@playblast_path@/@version@",
+    "playblastFilesAssets": "@playblastversion_path@/@identifier@_@version@@.(frame)@@extension@",
+    "playblastFilesShots": "@playblastversion_path@/@sequence@-@shot@_@identifier@_@version@@.(frame)@@extension@",
+}
+
+
+def find_project(path) -> str:
+    '''The prism project a file or folder is in, None when it is in none'''
+    path = os.path.abspath(str(path))
+    while True:
+        if any(os.path.isfile(os.path.join(path, PIPELINE_FOLDER, name)) for name in CONFIG_NAMES):
+            return path
+        parent = os.path.dirname(path)
+        if parent == path:
+            return None
+        path = parent
+
+
+def load_config(project_path) -> dict:
+    '''The pipeline config of a project, yaml configs need PyYAML'''
+    for name in CONFIG_NAMES:
+        path = os.path.join(project_path, PIPELINE_FOLDER, name)
+        if not os.path.isfile(path):
+            continue
+        with open(path, encoding="utf-8") as f:
+            if name.endswith(".json"):
+                return json.load(f)
+            import yaml # older projects only
+            return yaml.safe_load(f)
+    raise FileNotFoundError(f"No pipeline config in {project_path}")
+
+
+class PrismResolver:
+    '''
+    The read side of PrismCore for one project
+    core is the real PrismCore, started by fallback() the first time it is needed
+    '''
+    def __init__(self, project_path, fallback=None):
+        self._fallback = fallback
+        self._core = None
+        self.projects = _Projects(self)
+        self.mediaProducts = _MediaProducts(self)
+        self.entities = _Entities(self)
+        self.changeProject(project_path)
+
+    def changeProject(self, project_path):
+        self.projectPath = os.path.normpath(str(project_path))
+        self.config = load_config(self.projectPath)
+        settings = self.config.get("globals", {})
+        self.projectName = settings.get("project_name") or os.path.basename(self.projectPath)
+        self.versionFormat = f"v%0{int(settings.get('version_padding', 4))}d"
+        structure = self.config.get("folder_structure") or {}
+        self.structure = {
+            key: value.get("value") if isinstance(value, dict) else value
+            for key, value in {**DEFAULT_STRUCTURE, **structure}.items()
+        }
+        self._templates = {} # (key, entity type): templates.Template
+        if self._core is not None:
+            self._core.changeProject(self.projectPath)
+
+    @property
+    def core(self):
+        '''The real PrismCore, for what the resolver does not answer'''
+        if self._core is None:
+            if self._fallback is None:
+                raise RuntimeError("No PrismCore to fall back to")
+            LOG.info("Starting PrismCore")
+            self._core = self._fallback()
+            if self._core is None:
+                raise RuntimeError("PrismCore could not start")
+            self._core.changeProject(self.projectPath)
+        return self._core
+
+    def __getattr__(self, name):
+        # only called for what the resolver does not have, eg. saving versioninfo
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return getattr(self.core, name)
+
+    def template(self, key, entity_type=None) -> templates.Template:
+        cache_key = (key, entity_type)
+        template = self._templates.get(cache_key)
+        if template is None:
+            template = templates.compile_structure(self.structure.get, key, entity_type)
+            self._templates[cache_key] = template
+        return template
+
+    def getScenefileData(self, filepath) -> dict:
+        '''The context of a scenefile from its path, like PrismCore.getScenefileData'''
+        filepath = str(filepath)
+        for entity_type, key in (("asset", "assetScenefiles"), ("shot", "shotScenefiles")):
+            keys = self.template(key, entity_type).match(filepath)
+            if keys is None:
+                continue
+            context = {
+                "type": entity_type,
+                "project_path": self.projectPath,
+                "project_name": self.projectName,
+                "filename": filepath,
+                **{name: value for name, value in keys.items() if name != "project_path"},
+            }
+            if entity_type == "asset":
+                context["asset"] = os.path.basename(context["asset_path"])
+            return context
+        LOG.debug(f"{filepath} is no scenefile of {self.projectPath}")
+        return {}
+
+
+class _Projects:
+    def __init__(self, resolver):
+        self._resolver = resolver
+
+    def getProjectStructure(self) -> dict:
+        return {key: {"value": value} for key, value in self._resolver.structure.items()}
+
+    def getTemplatePath(self, key) -> str:
+        return self._resolver.structure.get(key)
+
+    def getResolvedProjectStructurePath(self, key, context) -> str:
+        '''the frame of a file template is only written when the context has one'''
+        context = {"project_path": self._resolver.projectPath, **context}
+        return self._resolver.template(key, context.get("type")).format(context)
+
+    def extractKeysFromPath(self, path, template) -> dict:
+        for entity_type in ("asset", "shot"):
+            expanded = templates.expand_refs(self._resolver.structure.get, template, entity_type)
+            keys = templates.Template(expanded).match(path)
+            if keys is not None:
+                return keys
+        return {}
+
+
+class _MediaProducts:
+    def __init__(self, resolver):
+        self._resolver = resolver
+
+    def _identifier_folder(self, context) -> str:
+        if context.get("mediaType") != "playblasts":
+            return None
+        context = {"project_path": self._resolver.projectPath, **context}
+        return self._resolver.template("playblasts", context.get("type")).format(context)
+
+    def getVersionsFromContext(self, context) -> list:
+        '''[{"version": "v0003", "path": ...}] of the version folders, oldest first'''
+        folder = self._identifier_folder(context)
+        if folder is None:
+            return self._resolver.core.mediaProducts.getVersionsFromContext(context)
+        versions = []
+        try:
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    match = _version_folder.match(entry.name)
+                    if match and entry.is_dir():
+                        versions.append((int(match.group(1)), entry.name, entry.path))
+        except OSError:
+            return []
+        return [{"version": name, "path": path} for _, name, path in sorted(versions)]
+
+    def getHighestMediaVersion(self, context, getExisting=True) -> str:
+        if context.get("mediaType") != "playblasts":
+            return self._resolver.core.mediaProducts.getHighestMediaVersion(context, getExisting=getExisting)
+        versions = self.getVersionsFromContext(context)
+        if versions:
+            number = int(_version_folder.match(versions[-1]["version"]).group(1))
+        else:
+            number = 0
+        return self._resolver.versionFormat % (number if getExisting else number + 1)
+
+
+class _Entities:
+    def __init__(self, resolver):
+        self._resolver = resolver
+
+    def getShotName(self, context) -> str:
+        return f"{context.get('sequence')}-{context.get('shot')}"
+
+    def getAsset(self, asset_path) -> str:
+        context = {"type": "asset", "project_path": self._resolver.projectPath, "asset_path": asset_path}
+        path = self._resolver.template("assets", "asset").format(context)
+        return path if os.path.isdir(path) else None
+
+    def getShotsFromSequence(self, sequence) -> list:
+        context = {"type": "shot", "project_path": self._resolver.projectPath, "sequence": sequence, "shot": "_"}
+        folder = os.path.dirname(self._resolver.template("shots", "shot").format(context))
+        try:
+            with os.scandir(folder) as entries:
+                shots = sorted(entry.name for entry in entries if entry.is_dir() and not entry.name.startswith("_"))
+        except OSError:
+            return []
+        return [{"sequence": sequence, "shot": shot} for shot in shots]
+
+
+def default_fallback():
+    '''PrismCore the way the entry points start it, inside Houdini or standalone'''
+    try:
+        import hou # noqa: F401
+    except ImportError:
+        import common
+        common.setup_imports()
+        return common.connect_prism(app="Standalone", prismArgs=["noUI"])
+    import PrismInit
+    return PrismInit.get_core() # the session core from pythonrc, not a second one
+
+
+def connect(path=None, fallback=default_fallback):
+    '''
+    Resolver for the project of path, falls back to PrismCore itself when
+    path is in no prism project, eg. an unsaved scene
+    '''
+    project_path = find_project(path) if path else None
+    if project_path is None:
+        LOG.info(f"No prism project found for {path}, starting PrismCore")
+        return fallback()
+    return PrismResolver(project_path, fallback=fallback)
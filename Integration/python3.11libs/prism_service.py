@@ -0,0 +1,247 @@
+'''
+Long-lived local service that answers the prism questions of the MPlay menu
+
+starting PrismCore takes seconds, so instead of every menu click doing it,
+the service keeps one warm along with the caches of logic.Logic, the scene
+contexts, compiled templates and version indexes, and answers over
+local_service. Reads come from prism_resolver, the warm PrismCore is there
+for what it can not answer. PrismCore is created on the main thread while
+the service is idle, and requests run there one at a time, so neither
+PrismCore nor the Logic caches are used from two threads
+
+ServiceLogic has the signatures of logic.Logic, so the save dialog can use
+it in place of Logic without a pcore
+
+--standin answers from the project configs and the disk only, no PrismCore,
+for testing without prism
+
+usage:
+    python prism_service.py serve
+    python prism_service.py --address /tmp/prism.sock serve --standin
+    python prism_service.py context /projects/demo/03_Production/Shots/SQ010/sh010/Scenefiles/fx/sim/SQ010-sh010_sim_v0004.hip
+    python prism_service.py shutdown
+'''
+
+import os
+import sys
+import json
+import argparse
+import logging
+
+import logic
+import local_service
+import prism_resolver
+
+LOG = logging.getLogger(__name__)
+
+
+def default_address() -> str:
+    return local_service.default_address("prism")
+
+
+class PrismService(local_service.Service):
+    '''
+    requests are dicts with an op, paths and contexts as json types:
+        context        filepath
+        contexts       filepaths
+        entity_path    filepath or context
+        latest_version context, identifier
+        outputpath     identifier, version, format, context, frame
+        label          context, status
+    '''
+    serial = True # PrismCore makes Qt objects, it stays on the main thread
+
+    def __init__(self, address=None, standin=False):
+        super().__init__(address or default_address())
+        self.standin = standin
+        self._prism = None # the warm PrismCore
+        self._prism_error = None # why it did not start, it is not tried again
+        self._resolvers = {} # project path: prism_resolver.PrismResolver
+
+    def idle(self):
+        # warms up once the service answers pings, so starting it is quick
+        if not self.standin and self._prism is None and self._prism_error is None:
+            self._fallback()
+
+    def core_for(self, filepath=None, context=None):
+        '''The resolver of the project of filepath or context, the warm PrismCore when there is none'''
+        project_path = (context or {}).get("project_path") or (prism_resolver.find_project(filepath) if filepath else None)
+        if project_path:
+            key = os.path.normcase(os.path.normpath(project_path))
+            resolver = self._resolvers.get(key)
+            if resolver is None:
+                resolver = prism_resolver.PrismResolver(project_path, fallback=None if self.standin else self._fallback)
+                self._resolvers[key] = resolver
+            return resolver
+        prism = None if self.standin else self._fallback()
+        if prism is None:
+            raise RuntimeError(f"{filepath or context} is in no prism project the service knows")
+        return prism
+
+    def _fallback(self):
+        '''The warm PrismCore, started on first use, None when it can not start'''
+        if self._prism is None and self._prism_error is None:
+            LOG.info("Starting PrismCore")
+            try:
+                self._prism = prism_resolver.default_fallback()
+            except Exception as e:
+                LOG.exception("PrismCore could not start")
+                self._prism_error = str(e)
+            if self._prism is None and self._prism_error is None:
+                self._prism_error = "PrismCore could not start"
+        return self._prism
+
+    def handle(self, request: dict) -> dict:
+        op = request.get("op")
+        Logic = logic.Logic
+        if op == "context":
+            filepath = request["filepath"]
+            return {"ok": True, "context": Logic.context_from_path(self.core_for(filepath), filepath)}
+        if op == "contexts":
+            by_core = {} # id(core): (core, filepaths), in practice one project
+            for filepath in request["filepaths"]:
+                core = self.core_for(filepath)
+                by_core.setdefault(id(core), (core, []))[1].append(filepath)
+            contexts = {}
+            for core, filepaths in by_core.values():
+                contexts.update(Logic.contexts_from_paths(core, filepaths))
+            return {"ok": True, "contexts": contexts}
+        if op == "entity_path":
+            filepath, context = request.get("filepath"), request.get("context")
+            path, context = Logic.get_entity_path(self.core_for(filepath, context), filepath, context)
+            return {"ok": True, "path": str(path), "context": context}
+        if op == "latest_version":
+            context = request["context"]
+            version = Logic.get_latest_playblast_version(self.core_for(context=context), context, request.get("identifier", ""))
+            return {"ok": True, "version": version}
+        if op == "outputpath":
+            context = request["context"]
+            path = Logic.construct_outputpath(
+                self.core_for(context=context), request["identifier"], request["version"], request["format"],
+                context, frame=request.get("frame", "$F4"),
+            )
+            return {"ok": True, "path": path}
+        if op == "label":
+            context = request["context"]
+            label = Logic.context_to_label(self.core_for(context=context), context, request.get("status", False))
+            return {"ok": True, "label": label}
+        return super().handle(request)
+
+
+class PrismServiceClient(local_service.ServiceClient):
+    '''requests can wait for PrismCore to warm up once, hence the longer timeout'''
+    def __init__(self, address=None, timeout=30.0):
+        super().__init__(address or default_address(), timeout)
+
+    def context_from_path(self, filepath) -> dict:
+        return self.request("context", filepath=str(filepath))["context"]
+
+    def contexts_from_paths(self, filepaths) -> dict:
+        return self.request("contexts", filepaths=[str(filepath) for filepath in filepaths])["contexts"]
+
+    def get_entity_path(self, filepath=None, context=None):
+        reply = self.request("entity_path", filepath=str(filepath) if filepath else None, context=context)
+        return reply["path"], reply["context"]
+
+    def latest_version(self, context, identifier="") -> int:
+        return self.request("latest_version", context=context, identifier=identifier)["version"]
+
+    def outputpath(self, identifier, version, format, context, frame="$F4") -> str:
+        return self.request(
+            "outputpath", identifier=identifier, version=version, format=format, context=context, frame=frame,
+        )["path"]
+
+    def context_label(self, context, status=False) -> str:
+        return self.request("label", context=context, status=status)["label"]
+
+
+def ensure_service(address=None, standin=False, timeout=local_service.START_TIMEOUT) -> PrismServiceClient:
+    '''
+    Client of the running service, starts one when there is none
+    raises local_service.ServiceUnavailable, once per session, callers fall back
+    '''
+    return local_service.ensure(PrismServiceClient(address), __file__, ["--standin"] if standin else [], timeout)
+
+
+class ServiceLogic(logic.Logic):
+    '''
+    logic.Logic for the save dialog, the prism questions go to the service
+    pcore arguments are ignored, the service has its own
+    '''
+    client = None # PrismServiceClient, connected on first use
+
+    @classmethod
+    def _client(cls) -> PrismServiceClient:
+        if cls.client is None:
+            cls.client = ensure_service(standin=os.environ.get("MPLAY_PRISM_SERVICE") == "standin")
+        return cls.client
+
+    @staticmethod
+    def context_from_path(pcore, filepath):
+        return ServiceLogic._client().context_from_path(filepath)
+
+    @staticmethod
+    def contexts_from_paths(pcore, filepaths) -> dict:
+        return ServiceLogic._client().contexts_from_paths(filepaths)
+
+    @staticmethod
+    def get_entity_path(pcore, filepath=None, context=None):
+        path, context = ServiceLogic._client().get_entity_path(filepath, context)
+        return logic.Path(path), context
+
+    @staticmethod
+    def fix_pcore_project(pcore, context) -> None:
+        pass # the service picks the project from the context
+
+    @staticmethod
+    def get_latest_playblast_version(pcore, context: dict, identifier: str="") -> int:
+        return ServiceLogic._client().latest_version(context, identifier)
+
+    @staticmethod
+    def construct_outputpath(pcore, identifier, version, format, context, frame="$F4"):
+        return ServiceLogic._client().outputpath(identifier, version, format, context, frame)
+
+    @staticmethod
+    def context_to_label(pcore, context, status=False):
+        return ServiceLogic._client().context_label(context, status)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--address", help="socket path or pipe name, defaults to one per user")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    serve = commands.add_parser("serve", help="run the service")
+    serve.add_argument("--standin", action="store_true", help="answer from project configs only, no PrismCore")
+
+    commands.add_parser("ping", help="check the service answers")
+    context = commands.add_parser("context", help="print the context of a scenefile")
+    context.add_argument("filepath")
+    commands.add_parser("shutdown", help="stop the service once it answered")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+
+    if args.command == "serve":
+        PrismService(args.address, standin=args.standin).serve()
+        return 0
+
+    client = PrismServiceClient(args.address)
+    if args.command == "ping":
+        running = client.ping()
+        print("running" if running else "not running")
+        return 0 if running else 1
+    if args.command == "context":
+        print(json.dumps(client.context_from_path(args.filepath), indent=4))
+        return 0
+    if args.command == "shutdown":
+        client.shutdown()
+        return 0
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,147 @@
+'''
+Prism path templates compiled into python format strings and regexes
+
+prism resolves a template like
+    @playblastversion_path@/@identifier@_@version@@.(frame)@@extension@
+by asking the project for every template it refers to, each time. Compiled
+once, filling in a context is a str.format_map and reading the keys back
+out of a path is one regex match
+
+@key@ is a context key, @prefix(key)suffix@ is optional and only written
+when the key has a value, eg. @.(frame)@ is .1001 for frames and nothing
+for a video. Keys that name other templates are expanded when compiling,
+see STRUCTURE_REFS
+
+usage:
+    template = templates.compile_structure(pcore.projects.getTemplatePath, "playblastFilesShots", "shot")
+    template.format(context, frame="$F4")
+    template.match(path)
+'''
+
+import re
+import sys
+
+_token = re.compile(r"@([^@/\\]+)@")
+_optional = re.compile(r"^(?P<prefix>[^()]*)\((?P<key>\w+)\)(?P<suffix>[^()]*)$")
+_key = re.compile(r"^\w+$")
+
+# what keys look like in a path, others match up to the next /
+_key_patterns = {
+    "frame": r"\d+|\$F\d*|#+",
+    "extension": r"\.[^/.]+",
+    "version": r"v\d+",
+}
+
+# template keys that stand for other templates of the project structure,
+# entity_path depends on the entity type
+STRUCTURE_REFS = {
+    "entity_path": {"asset": "assets", "shot": "shots"},
+    "playblast_path": "playblasts",
+    "playblastversion_path": "playblastVersions",
+    "department_path": "departments",
+    "task_path": "tasks",
+}
+
+
+class Template:
+    '''
+    One template with its references expanded, paths use forward slashes
+    keys ending in _path may span folders, eg. asset_path chars/bob
+    '''
+    def __init__(self, template: str):
+        self.template = template.replace("\\", "/")
+        self.keys = [] # each once, in order
+        self._optional = [] # (field, prefix, key, suffix)
+        format_parts = []
+        regex_parts = []
+        position = 0
+        for token in _token.finditer(self.template):
+            literal = self.template[position:token.start()]
+            format_parts.append(literal.replace("{", "{{").replace("}", "}}"))
+            regex_parts.append(re.escape(literal))
+            position = token.end()
+
+            name = token.group(1)
+            optional = _optional.match(name)
+            if optional:
+                prefix, key, suffix = optional.group("prefix", "key", "suffix")
+                field = f"_optional{len(self._optional)}"
+                self._optional.append((field, prefix, key, suffix))
+                format_parts.append(f"{{{field}}}")
+                regex_parts.append(f"(?:{re.escape(prefix)}{self._group(key)}{re.escape(suffix)})?")
+            elif _key.match(name):
+                format_parts.append(f"{{{name}}}")
+                regex_parts.append(self._group(name))
+            else:
+                raise ValueError(f"Can not compile @{name}@ of {template}")
+
+        literal = self.template[position:]
+        format_parts.append(literal.replace("{", "{{").replace("}", "}}"))
+        regex_parts.append(re.escape(literal))
+        self._format = "".join(format_parts)
+        flags = re.IGNORECASE if sys.platform == "win32" else 0
+        self.regex = re.compile("^" + "".join(regex_parts) + "$", flags)
+
+    def _group(self, key) -> str:
+        '''regex of a key, a key seen before must match the same text again'''
+        if key in self.keys:
+            return f"(?P={key})"
+        self.keys.append(key)
+        if key in _key_patterns:
+            return f"(?P<{key}>{_key_patterns[key]})"
+        return f"(?P<{key}>.+?)" if key.endswith("_path") else f"(?P<{key}>[^/]+?)"
+
+    def format(self, context: dict, **values) -> str:
+        '''
+        The path of context, values are added to it, eg. frame="$F4"
+        raises KeyError when a key of the template is missing
+        '''
+        values = {**context, **values}
+        for field, prefix, key, suffix in self._optional:
+            value = values.get(key)
+            values[field] = "" if value is None or value == "" else f"{prefix}{value}{suffix}"
+        for key in self.keys:
+            value = values[key] # KeyError for the caller
+            if isinstance(value, str) and "\\" in value:
+                values[key] = value.replace("\\", "/")
+        return self._format.format_map(values)
+
+    def match(self, path) -> dict:
+        '''The keys of path, None when it does not fit the template'''
+        found = self.regex.match(str(path).replace("\\", "/"))
+        if found is None:
+            return None
+        return {key: value for key, value in found.groupdict().items() if value is not None}
+
+    def __str__(self):
+        return self.template
+
+
+def expand(get_template, key, entity_type=None, _seen=()) -> str:
+    '''
+    The template of key with the templates it refers to filled in
+    get_template(key) returns the raw template, eg. pcore.projects.getTemplatePath
+    '''
+    if key in _seen:
+        raise ValueError(f"Template {key} refers to itself")
+    template = get_template(key)
+    if not template:
+        raise ValueError(f"No template {key} in the project")
+    return expand_refs(get_template, template, entity_type, _seen + (key,))
+
+
+def expand_refs(get_template, template, entity_type=None, _seen=()) -> str:
+    '''template with the templates it refers to filled in'''
+    def replace(token):
+        ref = STRUCTURE_REFS.get(token.group(1))
+        if isinstance(ref, dict):
+            ref = ref.get(entity_type)
+        if ref is None:
+            return token.group(0) # a context key
+        return expand(get_template, ref, entity_type, _seen)
+
+    return _token.sub(replace, template)
+
+
+def compile_structure(get_template, key, entity_type=None) -> Template:
+    return Template(expand(get_template, key, entity_type))
@@ -0,0 +1,238 @@
+'''
+Keeps the cached tree of an elPapi.Project current while a session is open
+
+every folder that has been listed is watched, when one changes it is listed
+again through Project.refresh_node, which also patches the indexes.
+nothing is walked again, folders that were never listed stay unlisted
+
+inotify is used on linux, elsewhere every listed folder is stat'ed each interval.
+inotify only sees changes made through this machine's kernel, for network
+shares written by other machines use polling=True
+
+usage:
+    project = elPapi.Project(path)
+    project.watch()
+    ...
+    project.stop_watching()
+'''
+
+import os
+import sys
+import time
+import ctypes
+import ctypes.util
+import select
+import struct
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+LOG = logging.getLogger(__name__)
+
+
+def _node_depth(node) -> int:
+    return len(node.parts())
+
+
+class PollingWatcher:
+    '''Stats every listed folder each interval seconds and lists the changed ones again'''
+    def __init__(self, project, interval=5.0, workers=None):
+        self.project = project
+        self.interval = interval
+        self.workers = workers
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name=f"{type(self).__name__}-{self.project.name}", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.poll()
+            except Exception:
+                LOG.exception("Failed to poll project folders")
+
+    def poll(self) -> int:
+        '''Checks every listed folder once, returns the number of folders listed again'''
+        nodes = [node for node in self.project.file_tree.walk() if node.loaded]
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            mtimes = pool.map(_stat_mtime, [node._ospath() for node in nodes])
+
+        changed = []
+        for node, mtime in zip(nodes, mtimes):
+            if mtime is None:
+                continue # removed, listing the parent drops it
+            if node.mtime is None:
+                node.mtime = mtime # built without mtimes, start from now
+            elif node.mtime != mtime:
+                changed.append(node)
+
+        # walk yields parents first, so removed children are dropped before their turn
+        for node in changed:
+            self.project.refresh_node(node)
+        return len(changed)
+
+
+def _stat_mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+# inotify constants from <sys/inotify.h>
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+
+# changes to the listing of a folder, file contents do not matter
+WATCH_MASK = IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+
+_event = struct.Struct("iIII") # wd, mask, cookie, len
+_libc = None
+
+
+def _load_libc():
+    global _libc
+    if _libc is None and sys.platform.startswith("linux"):
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+            libc.inotify_init1.argtypes = [ctypes.c_int]
+            libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+            libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+            _libc = libc
+        except (OSError, AttributeError) as e:
+            LOG.debug(f"inotify not available: {e}")
+    return _libc
+
+
+def inotify_available() -> bool:
+    return _load_libc() is not None
+
+
+class InotifyWatcher(PollingWatcher):
+    '''
+    Watches every listed folder with inotify
+    folders listed later are picked up every interval seconds
+    '''
+    def __init__(self, project, interval=5.0, workers=None):
+        super().__init__(project, interval, workers)
+        self._libc = _load_libc()
+        if self._libc is None:
+            raise OSError("inotify is not available on this platform")
+        self._fd = None
+        self._wds = {} # watch descriptor: node
+        self._watched = set()
+        self._lost = set() # watched folders that were removed or moved
+
+    def start(self):
+        fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        self._fd = fd
+        self._sync_watches()
+        return super().start()
+
+    def stop(self):
+        super().stop()
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+        self._wds.clear()
+        self._watched.clear()
+        self._lost.clear()
+
+    def _run(self):
+        last_sync = time.monotonic()
+        while not self._stop.is_set():
+            try:
+                if time.monotonic() - last_sync >= self.interval:
+                    self._sync_watches()
+                    last_sync = time.monotonic()
+                ready, _, _ = select.select([self._fd], [], [], min(self.interval, 0.5))
+                if ready:
+                    # parents first, so removed children are dropped before their turn
+                    for node in sorted(self._read_events(), key=_node_depth):
+                        self.project.refresh_node(node)
+            except Exception:
+                LOG.exception("Failed to apply folder changes")
+
+    def _sync_watches(self):
+        '''Adds a watch to every listed folder that has none yet'''
+        for node in self.project.file_tree.walk():
+            if not node.loaded or node in self._watched:
+                continue
+            path = node._ospath().encode(sys.getfilesystemencoding(), "surrogateescape")
+            wd = self._libc.inotify_add_watch(self._fd, path, WATCH_MASK)
+            if wd < 0:
+                LOG.debug(f"Could not watch {node._ospath()}: {os.strerror(ctypes.get_errno())}")
+                continue
+            self._wds[wd] = node
+            self._watched.add(node)
+            if node in self._lost:
+                # the folder came back, its old listing is stale
+                self._lost.discard(node)
+                self.project.refresh_node(node)
+
+    def _read_events(self) -> set:
+        '''Returns the nodes whose listing changed'''
+        changed = set()
+        while True:
+            try:
+                data = os.read(self._fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            if not data:
+                break
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = _event.unpack_from(data, offset)
+                offset += _event.size + length
+                node = self._wds.get(wd)
+                if node is None:
+                    continue
+                if mask & IN_IGNORED:
+                    del self._wds[wd]
+                    self._watched.discard(node)
+                    self._lost.add(node)
+                elif mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                    if node.above is not None:
+                        changed.add(node.above)
+                else:
+                    changed.add(node)
+        return changed
+
+
+def watch(project, interval=5.0, polling=None, workers=None):
+    '''
+    Starts a watcher for the project
+    polling=None uses inotify when the platform has it
+    '''
+    if polling is None:
+        polling = not inotify_available()
+    watcher_class = PollingWatcher if polling else InotifyWatcher
+    return watcher_class(project, interval=interval, workers=workers).start()